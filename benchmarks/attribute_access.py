@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+"""Micro-benchmark of typical attribute reads and writes across a large
+list of customers, compared against plain Python attribute access.
+
+Runs entirely offline:
+
+    $ python benchmarks/attribute_access.py [number of customers]"""
+
+import os
+import sys
+import timeit
+from xml.etree.ElementTree import fromstring
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pycheddar import Customer
+
+CUSTOMER_XML = """<customer id="{0}" code="CUSTOMER_{0}">
+    <firstName>First</firstName><lastName>Last</lastName>
+    <email>customer{0}@example.com</email><company>Example</company>
+    <createdDatetime>2011-01-01T00:00:00+00:00</createdDatetime>
+    <subscriptions><subscription id="s{0}">
+        <ccLastFour>1111</ccLastFour><canceledDatetime/>
+        <plans><plan id="p1" code="PRO"><name>Pro</name><isFree>0</isFree></plan></plans>
+    </subscription></subscriptions>
+</customer>"""
+
+
+class Plain(object):
+    """The floor: an object with ordinary instance attributes."""
+
+    def __init__(self):
+        self.email = 'customer@example.com'
+        self.first_name = 'First'
+
+
+def main(count):
+    customers = [Customer.from_xml(fromstring(CUSTOMER_XML.format(i))) for i in range(count)]
+    plains = [Plain() for i in range(count)]
+
+    def read_customer():
+        for c in customers:
+            c.email
+            c.first_name
+            c.code
+            c.subscription.cc_last_four
+
+    def read_plain():
+        for p in plains:
+            p.email
+            p.first_name
+            p.email
+            p.first_name
+
+    def write_customer():
+        for c in customers:
+            c.email = 'new@example.com'
+            c.subscription.cc_last_four = '2222'
+
+    def write_plain():
+        for p in plains:
+            p.email = 'new@example.com'
+            p.first_name = 'New'
+
+    for name, func, ops in (('plain reads', read_plain, 4), ('customer reads', read_customer, 4),
+                            ('plain writes', write_plain, 2), ('customer writes', write_customer, 2)):
+        best = min(timeit.repeat(func, number=1, repeat=5))
+        print('{0:<16} {1:8.1f} ns/op'.format(name, best / (count * ops) * 1e9))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
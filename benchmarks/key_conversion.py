@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+"""Benchmark of key case conversion, and its effect on hydrating objects
+with from_xml and on building requests, comparing the memoized conversion
+in pycheddar.utils against the original regular expression implementation.
+
+Runs entirely offline:
+
+    $ python benchmarks/key_conversion.py [number of customers]"""
+
+import os
+import re
+import sys
+import timeit
+from xml.etree.ElementTree import fromstring
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pycheddar
+from pycheddar import CheddarGetter, Customer, to_camel_case, to_underscores
+
+CUSTOMER_XML = """<customer id="{0}" code="CUSTOMER_{0}">
+    <firstName>First</firstName><lastName>Last</lastName><company>Example</company>
+    <email>customer{0}@example.com</email><notes/><gatewayToken/><isVatExempt>0</isVatExempt>
+    <vatNumber/><firstContactDatetime/><referer/><refererHost/><campaignSource/>
+    <campaignMedium/><campaignTerm/><campaignContent/><campaignName/>
+    <createdDatetime>2011-01-01T00:00:00+00:00</createdDatetime>
+    <modifiedDatetime>2011-01-01T00:00:00+00:00</modifiedDatetime>
+    <metaData><metaDatum id="m{0}"><name>tier</name><value>gold</value></metaDatum></metaData>
+    <subscriptions><subscription id="s{0}">
+        <gatewayToken/><ccFirstName>First</ccFirstName><ccLastName>Last</ccLastName>
+        <ccCompany/><ccCountry/><ccAddress/><ccCity/><ccState/><ccZip>77777</ccZip>
+        <ccType>visa</ccType><ccLastFour>1111</ccLastFour><ccExpirationDate>2013-01-31</ccExpirationDate>
+        <cancelType/><cancelReason/><canceledDatetime/><createdDatetime>2011-01-01T00:00:00+00:00</createdDatetime>
+        <plans><plan id="p1" code="PRO"><name>Pro</name><isFree>0</isFree><trialDays>0</trialDays>
+            <billingFrequency>monthly</billingFrequency><recurringChargeAmount>10.00</recurringChargeAmount>
+        </plan></plans>
+        <items><item id="i1" code="SEATS"><name>Seats</name><quantity>2</quantity></item></items>
+    </subscription></subscriptions>
+</customer>"""
+
+REQUEST_KWARGS = {
+    'first_name': 'First', 'last_name': 'Last', 'email': 'someone@example.com',
+    'subscription[plan_code]': 'PRO', 'subscription[cc_first_name]': 'First',
+    'subscription[cc_last_name]': 'Last', 'subscription[cc_number]': '4111111111111111',
+    'subscription[cc_expiration]': '01/2013', 'subscription[cc_zip]': '77777',
+}
+
+
+def legacy_to_underscores(key):
+    match = re.search(r'([A-Z])', key)
+    while match:
+        char = match.groups()[0]
+        key = key.replace(char, '_' + char.lower())
+        match = re.search(r'([A-Z])', key)
+
+    return key
+
+
+def legacy_to_camel_case(key):
+    while '_' in key:
+        ix = key.index('_')
+        next = key[ix + 1].upper()
+        key = key[0:ix] + next + key[ix + 2:]
+
+    return key
+
+
+def run(label, count, elements):
+    def hydrate():
+        for element in elements:
+            Customer.from_xml(element)
+
+    def build():
+        for i in range(count):
+            CheddarGetter._prepare('/customers/new/', code='CUSTOMER', **REQUEST_KWARGS)
+
+    for name, func in (('from_xml', hydrate), ('request building', build)):
+        best = min(timeit.repeat(func, number=1, repeat=3))
+        print('{0:<8} {1:<18} {2:10.0f} per second'.format(label, name, count / best))
+
+
+def main(count):
+    CheddarGetter.product_code = 'BENCHMARK'
+    elements = [fromstring(CUSTOMER_XML.format(i)) for i in range(count)]
+
+    run('memoized', count, elements)
+
+    # swap the original implementation in, everywhere pycheddar uses it
+    pycheddar.to_underscores, pycheddar.to_camel_case = legacy_to_underscores, legacy_to_camel_case
+    try:
+        run('legacy', count, elements)
+    finally:
+        pycheddar.to_underscores, pycheddar.to_camel_case = to_underscores, to_camel_case
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -1,13 +1,19 @@
 # vim: set fileencoding=utf-8 :
 
-import copy
 import datetime
 import re
 import requests
 import sys
+import time
 from .exceptions import *
 from .utils import *
-from xml.etree.ElementTree import fromstring
+from . import parallel
+from .deadline import Deadline, budgeted, request_timeout
+from .identity import IdentityMap
+from .profiler import HydrationProfiler
+from . import profiler as _profiler
+from .query import CustomerIndex
+from xml.etree.ElementTree import fromstring, tostring
 from urllib.parse import urlencode
 
 VERSION = '0.9.5'
@@ -20,8 +26,22 @@ class CheddarGetter:
     product_code = None
     timeout = 15.0
 
+    # a preloaded pycheddar.catalog.Catalog, if any; see catalog.preload()
+    catalog = None
+
+    # an IdentityMap shared by every fetch, if any
+    identity_map = None
+
+    # an object to send requests through in place of requests.post, if any;
+    # see pycheddar.cassette for recording and replaying traffic
+    transport = None
+
+    # a pycheddar.retry.RetryPolicy for retrying and hedging reads, if any
+    retry_policy = None
+
     @classmethod
-    def request(cls, path, code = None, item_code = None, product_code = None, pass_product_code = True, **kwargs):
+    @budgeted
+    def request(cls, path, code = None, item_code = None, product_code = None, pass_product_code = True, parse = True, **kwargs):
         """Process an arbitrary request to CheddarGetter.
 
         Ordinarily, you shouldn't have to call this method directly,
@@ -29,7 +49,51 @@ class CheddarGetter:
 
         The product code will be appended to the end of the request automatically,
         and does not need to be included. Override this behavior by passing
-        pass_product_code = False."""
+        pass_product_code = False.
+
+        The parsed XML response is returned. To get the raw response
+        body instead, pass parse = False.
+
+        The request is given CheddarGetter.timeout seconds, or whatever
+        remains of an active Deadline if that is less."""
+
+        url, data = cls._prepare(path, code=code, item_code=item_code, product_code=product_code,
+                                 pass_product_code=pass_product_code, **kwargs)
+        response = cls._send(url, data)
+
+        if parse is False:
+            return response.content
+
+        return cls._parse(response.content, response)
+
+    @classmethod
+    def _parse(cls, body, response = None):
+        """Parse a raw response body, raising UnexpectedResponse if it is
+        not valid XML or is an error."""
+
+        profiler = _profiler.current()
+        if profiler is not None:
+            started = time.perf_counter()
+
+        try:
+            content = fromstring(body)
+        except Exception as e:
+            raise UnexpectedResponse("The server sent back something that wasn't valid XML.",
+                                     response=response,
+                                     parent_exception=e)
+
+        if content.tag == 'error':
+            raise UnexpectedResponse(content.text, response=response)
+
+        if profiler is not None:
+            profiler.phase('parse', time.perf_counter() - started, len(body))
+
+        return content
+
+    @classmethod
+    def _prepare(cls, path, code = None, item_code = None, product_code = None, pass_product_code = True, **kwargs):
+        """Build the URL and POST data for a request, as described in
+        CheddarGetter.request. Return a (url, data) tuple."""
 
         # build the base request URL
         url = '%s/xml/%s' % (cls._server, path.strip('/'))
@@ -62,13 +126,9 @@ class CheddarGetter:
             url += '/itemCode/' + item_code
 
         # mangle the kwargs to make them match what
-        # CheddarGetter expects
-        for key in copy.copy(kwargs):
-            # move from Python naming conventions to Zend Framework conventions
-            # (read: underscores become camel-case)
-            if '_' in key:
-                kwargs[to_camel_case(key)] = kwargs[key]
-                del kwargs[key]
+        # CheddarGetter expects: move from Python naming conventions to
+        # Zend Framework conventions (read: underscores become camel-case)
+        kwargs = dict((to_camel_case(key) if '_' in key else key, val) for key, val in kwargs.items())
 
         # add in the product code
         if pass_product_code is True:
@@ -82,16 +142,49 @@ class CheddarGetter:
 
             url += '/productCode/' + product_code + '/'
 
+        return url, kwargs
+
+    @classmethod
+    def _send(cls, url, data, stream = False):
+        """Send a prepared request to CheddarGetter, and return the response.
+
+        Errors are raised as the appropriate pycheddar exception. If stream
+        is True, the body is left unread, to be consumed from response.raw.
+
+        If CheddarGetter.retry_policy is set, the request is sent through it."""
+
+        def send(timeout):
+            return cls._send_once(url, data, timeout, stream)
+
+        # only use what is left of the caller's time budget, if any
+        def timeout_for():
+            return request_timeout(cls.timeout)
+
+        if cls.retry_policy is not None:
+            return cls.retry_policy.call(url, send, timeout_for, stream=stream)
+        return send(timeout_for())
+
+    @classmethod
+    def _send_once(cls, url, data, timeout, stream = False):
+        """Send a prepared request to CheddarGetter exactly once, with
+        the given timeout; see CheddarGetter._send."""
+
+        post = requests.post if cls.transport is None else cls.transport.post
+
+        profiler = _profiler.current()
+        if profiler is not None:
+            started = time.perf_counter()
+
         # Attempt to handle every possible exception under the sun...
         try:
-            response = requests.post(url,
-                                     auth=cls.credentials,
-                                     data=kwargs,
-                                     timeout=cls.timeout,
-                                     stream=True)
+            response = post(url,
+                            auth=cls.credentials,
+                            data=data,
+                            timeout=timeout,
+                            stream=True)
 
         except requests.exceptions.Timeout as e:
-            raise Timeout('Waited {0} seconds'.format(cls.timeout), parent_exception=e)
+            raise Timeout('Waited {0} seconds'.format(timeout), parent_exception=e)
 
         except requests.exceptions.ConnectionError as e:
             raise ConnectionError(parent_exception=e)
@@ -118,23 +211,118 @@ class CheddarGetter:
                                                                               response=response,
                                                                               parent_exception=e)
 
-        try:
-            content = fromstring(response.content)
-        except Exception as e:
-            raise UnexpectedResponse("The server sent back something that wasn't valid XML.",
-                                     response=response,
-                                     parent_exception=e)
+        if stream is False:
+            # read the body now, while still inside the time budget
+            response.content
 
-        if content.tag == 'error':
-            raise UnexpectedResponse(content.text, response=response)
+        if profiler is not None:
+            profiler.phase('network', time.perf_counter() - started, 0 if stream else len(response.content))
 
-        return content
+        return response
+
+
+def compile_projection(only):
+    """Turn a list of dotted field paths into a nested dictionary, in which
+    a value of None means "load everything below this point".
+
+    An already compiled projection (or None) is returned unchanged."""
+
+    if only is None or isinstance(only, dict):
+        return only
+
+    projection = {}
+    for path in only:
+        node = projection
+        parts = path.split('.')
+        for part in parts[:-1]:
+            if part in node and node[part] is None:
+                break
+            node = node.setdefault(part, {})
+        else:
+            node[parts[-1]] = None
+
+    return projection
+
+
+# the methods of the data dictionary (exposed through __getattr__) that
+# change it, and so must keep the mirrored fields in step
+_DICT_MUTATORS = frozenset(('clear', 'pop', 'popitem', 'setdefault', 'update'))
+
+
+def _compact(element):
+    """Return a compact form of an element to hold on to until it is needed."""
+
+    # nodes from the parallel decoder are already compact
+    return tostring(element) if hasattr(element, 'makeelement') else element
+
+
+def _expand(raw):
+    """Turn the result of _compact back into something from_xml accepts."""
+
+    return fromstring(raw) if isinstance(raw, bytes) else raw
+
+
+def _newest_first(pairs):
+    """Return the indexes of (sort value, child) pairs, newest first;
+    children without a sort value go last."""
+
+    return sorted(range(len(pairs)), key=lambda index: (pairs[index][0] or '', index), reverse=True)
+
+
+def _child_text(element, tag):
+    """Return the text of the first child of element with the given tag."""
+
+    for child in element:
+        if child.tag == tag:
+            return child.text
+    return None
 
 
 class CheddarObject(object):
     """A object that can represent most objects that come down
     from CheddarGetter."""
 
+    # the underscored names of the fields CheddarGetter sends for this
+    # kind of object; their values are mirrored from the data dictionary
+    # into the instance dictionary, so reading one is a plain attribute
+    # lookup, and writes to them skip straight to the data dictionary
+    _fields = ()
+    _field_set = frozenset()
+
+    # relationships that are kept as compact raw XML when loaded, and only
+    # turned into objects when first accessed; each maps to the tag of a
+    # field read up front from every child, for ordering them (or None)
+    _lazy = {}
+
+    # how many of the newest children of a lazy relationship are kept as
+    # parsed elements, ready for the first page; the rest are serialized
+    _lazy_parsed = 10
+
+    def __init_subclass__(cls, **kwargs):
+        """Collect the fields declared on a subclass and its parents."""
+
+        super(CheddarObject, cls).__init_subclass__(**kwargs)
+
+        # never shadow methods, or the dict methods __getattr__ exposes
+        cls._field_set = frozenset(key for klass in cls.__mro__
+                                   for key in klass.__dict__.get('_fields', ())
+                                   if not hasattr(cls, key) and not hasattr(dict, key))
+
+    def _set_field(self, key, value):
+        """Set a known field in the data dictionary, and its mirror."""
+
+        self._data[key] = value
+        self.__dict__[key] = value
+
+    def _sync_fields(self):
+        """Bring the mirrored fields back in step with the data dictionary."""
+
+        for key in self._field_set:
+            if key in self._data:
+                self.__dict__[key] = self._data[key]
+            elif not isinstance(self.__dict__.get(key), (CheddarObject, list)):
+                self.__dict__.pop(key, None)
+
     def __init__(self, parent = None, **kwargs):
         """Instantiate the object."""
 
@@ -144,6 +332,10 @@ class CheddarObject(object):
         self._id = None
         self._code = None
         self._cursor = 0
+        self._projection = None
+        self._identity_map = None
+        self._shared = False
+        self._raw_children = {}
 
         # is this object a child of some other object?
         # note the relationship if it's sent
@@ -158,10 +350,17 @@ class CheddarObject(object):
     def __setattr__(self, key, value):
         """Set an arbitrary attribute on this object."""
 
+        # known fields holding plain values go straight to the data dictionary
+        if key in self._field_set and not isinstance(value, (CheddarObject, list)):
+            self._data[key] = self.__dict__[key] = value
         # if this item is private, set the instance's
         # attribute dictionary directly
-        if key[0] == '_':
+        elif key[0] == '_':
             self.__dict__[key] = value
+
+            # the ID and code are mirrored like known fields
+            if key == '_id' or key == '_code':
+                self.__dict__[key[1:]] = value
         elif key == 'code':
             # code can only be modified if the id is not set
             if self._id is None:
@@ -179,7 +378,11 @@ class CheddarObject(object):
         else:
             # in normal situations, write this item to the
             # self._data dictionary (using underscores, always)
-            self._data[to_underscores(key)] = value
+            key = to_underscores(key)
+            if key in self._field_set:
+                self._set_field(key, value)
+            else:
+                self._data[key] = value
 
     def __getattr__(self, key):
         """Return an arbitrary attribute on this object."""
@@ -187,7 +390,16 @@ class CheddarObject(object):
         # is this a dict method? if so, use the self._data
         # method
         if hasattr(self._data, key):
-            return getattr(self._data, key)
+            method = getattr(self._data, key)
+            if key not in _DICT_MUTATORS:
+                return method
+
+            def mutate(*args, **kwargs):
+                try:
+                    return method(*args, **kwargs)
+                finally:
+                    self._sync_fields()
+            return mutate
 
         # handle the id and code in a special way
         if key == 'id' or key == 'code':
@@ -197,10 +409,22 @@ class CheddarObject(object):
         if key[0] == '_' or key in self.__dict__:
             return self.__dict__[key]
 
+        # is this a lazily loaded relationship? if so, load it now
+        raw_children = self.__dict__.get('_raw_children')
+        if raw_children and key in raw_children:
+            only, raws = raw_children.pop(key)
+            self._load_children(key, [_expand(raw) for sort_value, raw in raws], only)
+            return self.__dict__[key]
+
         # retrieve from the self._data dictionary
         if key in self._data:
             return self._data[to_underscores(key)]
 
+        # was this field left out when the object was fetched?
+        projection = self.__dict__.get('_projection')
+        if projection is not None and to_underscores(key) not in projection:
+            raise FieldNotLoaded('Field "{0}" was not loaded; add it to the "only" projection.'.format(key))
+
         raise AttributeError('Key "{0}" does not exist.'.format(key))
 
     def __eq__(self, other):
@@ -251,22 +475,83 @@ class CheddarObject(object):
         Data loaded through this method is assumed to be clean.
         If it is dirty data (in other words, data that does not
         match what is currently saved in CheddarGetter), set kwarg
-        clean = False."""
+        clean = False.
+
+        To load only some fields, pass a list of field names as
+        only; see TopCheddarObject.fetch.
+
+        If an IdentityMap is sent as identity_map, objects that are
+        shared between many others (see _is_shared) are interned in it.
+        Interned objects are not linked to the parent they were found
+        under, unless that parent is interned too (as with the items
+        defined on a plan). Objects fetched directly (with no parent)
+        are always loaded afresh, along with their shared children, and
+        replace what was interned."""
 
         # default "clean" to True and "parent" to None
         clean = kwargs.pop('clean', True)
         parent = kwargs.pop('parent', None)
+        only = compile_projection(kwargs.pop('only', None))
+        identity_map = kwargs.pop('identity_map', None)
 
         # I don't recognize any other kwargs
         if kwargs:
             raise KeyError('Unrecognized keyword argument(s): {0}'.format(', '.join(list(kwargs.keys()))))
 
-        # create the new object and load in the data
-        new = cls(parent=parent)
-        new._load_data_from_xml(xml, clean)
+        # shared objects found under an unshared parent (a plan on a
+        # subscription) are reused if already interned, and never linked
+        # to that parent, which is just whichever one loaded them first;
+        # objects fetched directly, or under a shared parent that is being
+        # loaded, are loaded afresh and replace what was interned
+        shared = identity_map is not None and cls._is_shared(parent) and xml.get('id') is not None
+        detached = shared and parent is not None and not parent._shared
+        if detached:
+            existing = identity_map.get(cls, xml.get('id'), only)
+            if existing is not None:
+                if _profiler.current() is not None:
+                    _profiler.current().reuse()
+                return existing
+
+        profiler = _profiler.current()
+        if profiler is not None:
+            frame = profiler.enter(cls, xml, parent)
+
+        built = None
+        try:
+            # create the new object and load in the data
+            new = cls(parent=None if detached else parent)
+            new._shared = shared
+            new._projection = only
+            new._identity_map = identity_map
+            new._load_data_from_xml(xml, clean)
+
+            if only is not None:
+                # drop any defaults the constructor set up for fields that
+                # were not projected, so that accessing them raises
+                relationship = parent.__class__.__name__.lower() if parent is not None and not detached else None
+                for key in list(new.__dict__):
+                    if key[0] != '_' and key not in only and key not in (relationship, 'id', 'code'):
+                        del new.__dict__[key]
+
+            if shared:
+                identity_map.add(new, only)
+
+            built = new
+        finally:
+            # a failed load leaves no frame behind
+            if profiler is not None:
+                profiler.exit(frame, built)
 
         # done -- return the new object
-        return new
+        return built
+
+    @classmethod
+    def _is_shared(cls, parent):
+        """Return True if objects of this class, loaded under the given
+        parent, are definitions shared by many other objects (and so may
+        be interned in an identity map), False otherwise."""
+
+        return False
 
     def _load_data_from_xml(self, xml, clean = True):
         """Load information for this object based on XML retrieved
@@ -290,6 +575,8 @@ class CheddarObject(object):
             ('invoice', 'transactions'),   # I'm not sure what this relationship is
         )
 
+        projection = self._projection
+
         for child in list(xml):
             key = to_underscores(child.tag)
             # is this an element with children? if so, it's an object
@@ -302,35 +589,55 @@ class CheddarObject(object):
                     single_xml = list(child)[0]
                     class_name = single_xml.tag.capitalize()
 
+                    # skip relationships left out of the projection
+                    if projection is not None and single_xml.tag not in projection:
+                        continue
+                    only = projection[single_xml.tag] if projection is not None else None
+
                     if hasattr(sys.modules[__name__], class_name):
                         klass = getattr(sys.modules[__name__], class_name)
-                        setattr(self, single_xml.tag, klass.from_xml(single_xml, parent=self))
+                        setattr(self, single_xml.tag, klass.from_xml(single_xml, parent=self, only=only,
+                                                                       identity_map=self._identity_map))
 
                         # denote a clean version as well
                         setattr(self, '_clean_{0}'.format(single_xml.tag), getattr(self, single_xml.tag))
 
-                else:
-                    # okay, it's not a single relationship -- follow my normal
-                    # process for a many to many
-                    setattr(self, key, [])
-
-                    for indiv_xml in list(child):
-                        # get the class that this item is
-                        try:
-                            klass = getattr(sys.modules[__name__], indiv_xml.tag.capitalize())
-
-                            # the XML underneath here constitutes the necessary
-                            # XML to generate that object; call its XML function
-                            getattr(self, key).append(klass.from_xml(indiv_xml, parent=self))
-                        except AttributeError:
-                            break
+                        # an invoice may have more than one transaction (a
+                        # declined attempt and a retry, say); keep them all
+                        if (xml.tag, child.tag) == ('invoice', 'transactions'):
+                            setattr(self, key, [getattr(self, single_xml.tag)] +
+                                    [klass.from_xml(indiv_xml, parent=self, only=only, identity_map=self._identity_map)
+                                     for indiv_xml in list(child)[1:]])
 
-                        # set the clean version
-                        setattr(self, '_clean_' + key, getattr(self, key))
+                else:
+                    # skip relationships left out of the projection
+                    if projection is not None and key not in projection:
+                        continue
+                    only = projection[key] if projection is not None else None
+
+                    if key in self._lazy:
+                        # keep lazy relationships raw until they're accessed:
+                        # the newest few as they were parsed, and the rest
+                        # as compact serialized XML
+                        self.__dict__.pop(key, None)
+                        sort_tag = self._lazy[key]
+                        raws = [(_child_text(indiv_xml, sort_tag) if sort_tag else None, indiv_xml)
+                                for indiv_xml in child]
+                        if _profiler.current() is not None:
+                            _profiler.current().defer(child)
+                        parsed = set(_newest_first(raws)[:self._lazy_parsed])
+                        self._raw_children[key] = (only, [(sort_value, indiv_xml if index in parsed else _compact(indiv_xml))
+                                                          for index, (sort_value, indiv_xml) in enumerate(raws)])
+                    else:
+                        self._load_children(key, list(child), only)
 
                 # done; move to the next child
                 continue
 
+            # skip fields left out of the projection
+            if projection is not None and key not in projection:
+                continue
+
             # get the element value -- if it's numeric, convert it
             value = child.text
 
@@ -348,11 +655,38 @@ class CheddarObject(object):
 
             # set the data dictionaries in my object to
             # these values
-            self._data[key] = value
+            if key in self._field_set:
+                self._set_field(key, value)
+            else:
+                self._data[key] = value
 
             if clean is True:
                 self._clean_data[key] = value
 
+    def _load_children(self, key, elements, only = None):
+        """Create the list of child objects for a relationship from their XML.
+
+        This method should be considered opaque."""
+
+        # okay, it's not a single relationship -- follow my normal
+        # process for a many to many
+        setattr(self, key, [])
+
+        for indiv_xml in elements:
+            # get the class that this item is
+            try:
+                klass = getattr(sys.modules[__name__], indiv_xml.tag.capitalize())
+
+                # the XML underneath here constitutes the necessary
+                # XML to generate that object; call its XML function
+                getattr(self, key).append(klass.from_xml(indiv_xml, parent=self, only=only,
+                                                       identity_map=self._identity_map))
+            except AttributeError:
+                break
+
+            # set the clean version
+            setattr(self, '_clean_' + key, getattr(self, key))
+
     def _build_kwargs(self):
         """Build the list of keyword arguments based on all items
         modified in the current self._data dictionary."""
@@ -389,33 +723,93 @@ class TopCheddarObject(CheddarObject):
     """A CheddarGetter object which is available directly for query."""
 
     @classmethod
+    @budgeted
     def fetch(cls, *args, **kwargs):
-        """Generic helper for fetching objects from CheddarGetter."""
+        """Generic helper for fetching objects from CheddarGetter.
 
-        method = kwargs.pop('method', 'get')
+        For very large responses, pass processes = N to split the XML
+        decoding across N worker processes; the objects themselves
+        are still built in this process. Responses too small to be worth
+        a process pool are parsed as usual.
+
+        To hydrate only the fields you need, pass a list of dotted field
+        paths as only, e.g. only = ['email', 'subscription.plan.code'].
+        Naming a relationship on its own loads it in full. Accessing a
+        field that was not loaded raises FieldNotLoaded.
 
-        xml = CheddarGetter.request('/{0}s/{1}/'.format(cls.__name__.lower(), method), **kwargs)
-        return [cls.from_xml(obj_xml) for obj_xml in xml.iter(tag=cls.__name__.lower())]
+        Plans, plan items and promotions repeated across the response
+        can be loaded once and shared by passing an IdentityMap as
+        identity_map (or True, for a map scoped to this fetch). If none
+        is sent, CheddarGetter.identity_map is used."""
+
+        method = kwargs.pop('method', 'get')
+        processes = kwargs.pop('processes', None)
+        only = compile_projection(kwargs.pop('only', None))
+        identity_map = kwargs.pop('identity_map', CheddarGetter.identity_map)
+        if identity_map is True:
+            identity_map = IdentityMap()
+
+        path = '/{0}s/{1}/'.format(cls.__name__.lower(), method)
+        tag = cls.__name__.lower()
+
+        if processes and processes > 1:
+            content = CheddarGetter.request(path, parse=False, **kwargs)
+            if parallel.worthwhile(content, processes):
+                return [cls.from_xml(obj_xml, only=only, identity_map=identity_map)
+                        for obj_xml in parallel.decode(content, tag, processes)]
+
+            # too small to be worth a pool; parse it the usual way
+            xml = CheddarGetter._parse(content)
+        else:
+            xml = CheddarGetter.request(path, **kwargs)
+        return [cls.from_xml(obj_xml, only=only, identity_map=identity_map) for obj_xml in xml.iter(tag=tag)]
 
     @classmethod
-    def all(cls):
+    @budgeted
+    def all(cls, **kwargs):
         """Get all objects of this type from the product."""
 
+        catalog = CheddarGetter.catalog
+        if not kwargs and catalog is not None and cls.__name__ in catalog:
+            return catalog.all(cls)
+
         try:
-            return cls.fetch()
+            return cls.fetch(**kwargs)
         except NotFound:
             return []
 
     @classmethod
-    def get(cls, code):
+    @budgeted
+    def get(cls, code, only = None):
         """Get a single object of this type."""
 
-        return cls.fetch(code=code)[0]
+        # answer from the preloaded catalog if it holds this object
+        catalog = CheddarGetter.catalog
+        if catalog is not None and cls.__name__ in catalog:
+            obj = catalog.get(cls, code, only=compile_projection(only))
+            if obj is not None:
+                return obj
+
+        return cls.fetch(code=code, only=only)[0]
 
 
 class Plan(TopCheddarObject):
     """An object representing a CheddarGetter pricing plan."""
 
+    _fields = ('name', 'description', 'is_active', 'is_free', 'trial_days',
+               'billing_frequency', 'billing_frequency_per', 'billing_frequency_unit',
+               'billing_frequency_quantity', 'next_invoice_billing_datetime',
+               'initial_bill_count', 'initial_bill_count_unit',
+               'setup_charge_code', 'setup_charge_amount',
+               'recurring_charge_code', 'recurring_charge_amount', 'created_datetime')
+
+    @classmethod
+    def _is_shared(cls, parent):
+        """Plans are the same for every customer subscribed to them."""
+
+        return True
+
+    @budgeted
     def delete(self):
         """Delete the pricing plan in CheddarGetter."""
 
@@ -426,6 +820,13 @@ class Plan(TopCheddarObject):
         except UnexpectedResponse:
             pass
 
+        # don't let the preloaded catalog, or the shared identity map,
+        # keep answering for this plan
+        if CheddarGetter.catalog is not None:
+            CheddarGetter.catalog.discard(Plan, self._code)
+        if CheddarGetter.identity_map is not None:
+            CheddarGetter.identity_map.discard(Plan, self._id)
+
     def is_free(self):
         """Return True if CheddarGetter considers this plan to be free,
         False otherwise."""
@@ -447,6 +848,12 @@ class Plan(TopCheddarObject):
 class Customer(TopCheddarObject):
     """An object representing a CheddarGetter customer."""
 
+    _fields = ('first_name', 'last_name', 'company', 'email', 'notes',
+               'gateway_token', 'is_vat_exempt', 'vat_number', 'first_contact_datetime',
+               'referer', 'referer_host', 'campaign_source', 'campaign_medium',
+               'campaign_term', 'campaign_content', 'campaign_name',
+               'created_datetime', 'modified_datetime')
+
 
     def __init__(self, **kwargs):
         self.subscription = Subscription(parent=self)
@@ -456,6 +863,7 @@ class Customer(TopCheddarObject):
             self.meta_data = []
 
     @classmethod
+    @budgeted
     def list(cls, *args, **kwargs):
         """Retrieve all customers in CheddarGetter, allowing filters.
         Uses the more efficient customers/list/ method which is faster,
@@ -468,6 +876,7 @@ class Customer(TopCheddarObject):
             return []
 
     @classmethod
+    @budgeted
     def search(cls, **kwargs):
         """Get customers in the CheddarGetter product plan,
         filters by the provided keyword arguments.
@@ -500,6 +909,7 @@ class Customer(TopCheddarObject):
 
         return True
 
+    @budgeted
     def save(self):
         """Save this customer to CheddarGetter"""
 
@@ -550,6 +960,7 @@ class Customer(TopCheddarObject):
 
         return self
 
+    @budgeted
     def delete(self):
         """Delete this customer from CheddarGetter."""
 
@@ -572,6 +983,7 @@ class Customer(TopCheddarObject):
 
         raise ValueError('Item not found with code "{0}".'.format(item_code))
 
+    @budgeted
     def add_charge(self, charge_code, item_code, amount=0.0, quantity=1, description=None):
         """Increment item quantity for additional charges."""
 
@@ -616,10 +1028,104 @@ class Customer(TopCheddarObject):
         else:
             self.meta_data.append(Metadatum(name=name, value=value))
 
+    def invoice_history(self, page_size = 10):
+        """Iterate over this customer's invoices, newest first, in pages
+        of page_size InvoicePage objects carrying running totals.
+
+        Only the invoices on the current page are turned into objects; the
+        rest stay as compact raw XML, so the first page (the most recent
+        invoices) is available without loading the whole history."""
+
+        subscription = self.subscription
+        raw_children = subscription._raw_children
+
+        # like any other field, invoices left out of the projection raise
+        projection = subscription._projection
+        if projection is not None and 'invoices' not in projection:
+            raise FieldNotLoaded('Field "invoices" was not loaded; add it to the "only" projection.')
+
+        if 'invoices' in raw_children:
+            only, raws = raw_children['invoices']
+
+            # newest first; invoices without a billing date go last
+            ordered = [raws[index][1] for index in _newest_first(raws)]
+
+            def hydrate(raw):
+                return Invoice.from_xml(_expand(raw), parent=subscription, only=only,
+                                        identity_map=subscription._identity_map)
+        else:
+            # the invoices have already been loaded (or there are none)
+            invoices = subscription.__dict__.get('invoices') or []
+            ordered = [invoice for index, invoice in
+                       sorted(enumerate(invoices), key=lambda pair: (pair[1]._data.get('billing_datetime') or '', pair[0]),
+                              reverse=True)]
+
+            def hydrate(invoice):
+                return invoice
+
+        running_charged = running_paid = 0.0
+        for number, start in enumerate(range(0, len(ordered), page_size)):
+            page = InvoicePage(number, [hydrate(raw) for raw in ordered[start:start + page_size]],
+                               running_charged, running_paid, start + page_size < len(ordered))
+            running_charged, running_paid = page.running_charged, page.running_paid
+            yield page
+
+
+class InvoicePage(object):
+    """A page of a customer's invoice history; see Customer.invoice_history.
+
+    charged is the total of the charges on this page's invoices, and paid
+    the total of their approved transactions (less refunds); running_charged
+    and running_paid are the same totals for this page and every newer one."""
+
+    def __init__(self, number, invoices, running_charged = 0.0, running_paid = 0.0, has_next = False):
+        self.number = number
+        self.invoices = invoices
+        self.has_next = has_next
+
+        self.charged = 0.0
+        self.paid = 0.0
+        for invoice in invoices:
+            for charge in invoice.__dict__.get('charges') or []:
+                quantity = charge._data.get('quantity')
+                if quantity is None:
+                    quantity = 1
+                self.charged += float(charge._data.get('each_amount') or 0) * float(quantity)
+
+            transactions = invoice.__dict__.get('transactions')
+            if transactions is None and invoice.__dict__.get('transaction') is not None:
+                transactions = [invoice.transaction]
+            for transaction in transactions or []:
+                # declined and failed transactions took no money
+                if transaction._data.get('response') != 'approved':
+                    continue
+                amount = float(transaction._data.get('amount') or 0)
+                self.paid += -amount if transaction._data.get('is_refund') else amount
+
+        self.running_charged = running_charged + self.charged
+        self.running_paid = running_paid + self.paid
+
+    def __iter__(self):
+        return iter(self.invoices)
+
+    def __len__(self):
+        return len(self.invoices)
+
 
 class Subscription(CheddarObject):
     """An object representing a CheddarGetter subscription."""
 
+    # plan_code, cc_number and cc_expiration are deliberately left out;
+    # they need the special handling in __getattr__ and __setattr__
+    _fields = ('gateway_token', 'cc_first_name', 'cc_last_name', 'cc_company',
+               'cc_country', 'cc_address', 'cc_city', 'cc_state', 'cc_zip',
+               'cc_type', 'cc_last_four', 'cc_expiration_date', 'cc_email',
+               'cancel_type', 'cancel_reason', 'canceled_datetime', 'created_datetime')
+
+    # long-lived customers accumulate a lot of invoices; keep them raw
+    # until they're needed (see also Customer.invoice_history)
+    _lazy = {'invoices': 'billingDatetime'}
+
     def __init__(self, **kwargs):
         self._clean_plan = self.plan = Plan()
         super(Subscription, self).__init__(**kwargs)
@@ -632,12 +1138,19 @@ class Subscription(CheddarObject):
         return super(Subscription, self).__getattr__(key)
 
     def __setattr__(self, key, value):
+        # known fields have no special handling
+        if key in self._field_set and not isinstance(value, (CheddarObject, list)):
+            self._data[key] = self.__dict__[key] = value
+            return
+
+        underscored = to_underscores(key)
+
         # intercept the number and format it as digits only
-        if to_underscores(key) == 'cc_number':
+        if underscored == 'cc_number':
             return super(Subscription, self).__setattr__(key, re.sub(r'[\D]', '', value))
 
         # intercept the expiration date and format it how CheddarGetter expects
-        if to_underscores(key) == 'cc_expiration':
+        if underscored == 'cc_expiration':
             if value[2] != '/':
                 value = value[0:2] + '/' + value[2:]
 
@@ -660,7 +1173,7 @@ class Subscription(CheddarObject):
         # plan and plan_code are special; I want to accept a plan code
         # string for both, or a Plan object for self.plan -- in all three
         # cases, I want to write a Plan object to self.plan
-        if to_underscores(key) == 'plan_code' or (key == 'plan' and not isinstance(value, Plan)):
+        if underscored == 'plan_code' or (key == 'plan' and not isinstance(value, Plan)):
             self.plan = Plan.get(value)
         else:
             super(Subscription, self).__setattr__(key, value)
@@ -697,6 +1210,7 @@ class Subscription(CheddarObject):
 
         return kwargs
 
+    @budgeted
     def save(self):
         """Save this object's properties to CheddarGetter."""
 
@@ -723,6 +1237,7 @@ class Subscription(CheddarObject):
 
         return self
 
+    @budgeted
     def delete(self):
         """Remove this subscription from CheddarGetter."""
 
@@ -731,17 +1246,30 @@ class Subscription(CheddarObject):
         except UnexpectedResponse:
             pass
 
-    def cancel(self):
+    def cancel(self, **kwargs):
         """Alias to Subscription.delete() -- provided because CheddarGetter
-        uses the method name "cancel" for the URL.
+        uses the method name "cancel" for the URL. Keyword arguments (such
+        as deadline) are passed along.
 
         For consistency, Subscription.delete() is preferred."""
-        return self.delete()
+        return self.delete(**kwargs)
 
 
 class Item(CheddarObject):
     """An object representing a distinct item."""
 
+    # quantity is deliberately left out; it needs the special
+    # handling in __getattr__ and __setattr__
+    _fields = ('name', 'quantity_included', 'is_periodic', 'overage_amount',
+               'created_datetime', 'modified_datetime')
+
+    @classmethod
+    def _is_shared(cls, parent):
+        """Items are only shared when they are the definitions on a plan;
+        items on a subscription carry that customer's quantity."""
+
+        return isinstance(parent, Plan)
+
     def __setattr__(self, key, value):
         """Set an arbitrary attribute."""
 
@@ -785,6 +1313,7 @@ class Item(CheddarObject):
 
         return True
 
+    @budgeted
     def save(self):
         """Save this item back to CheddarGetter."""
 
@@ -800,6 +1329,7 @@ class Item(CheddarObject):
 
         return self
 
+    @budgeted
     def add(self, quantity):
         """Increment item quantity back to CheddarGetter."""
         self.quantity += quantity
@@ -818,14 +1348,26 @@ class Item(CheddarObject):
 class Promotion(TopCheddarObject):
     """An object representing a CheddarGetter promotion."""
 
+    _fields = ('name', 'description', 'created_datetime')
+
+    @classmethod
+    def _is_shared(cls, parent):
+        """Promotions are the same wherever they are referenced."""
+
+        return True
+
 
 class Charge(CheddarObject):
     """An object representing a CheddarGetter charge."""
 
+    _fields = ('type', 'quantity', 'each_amount', 'description', 'created_datetime')
+
 
 class Coupon(CheddarObject):
     """An object representing a CheddarGetter coupon."""
 
+    _fields = ('max_redemptions', 'expiration_datetime', 'created_datetime')
+
 
 class Incentive(CheddarObject):
     """
@@ -837,14 +1379,29 @@ class Incentive(CheddarObject):
 class Invoice(CheddarObject):
     """An object representing a CheddarGetter invoice."""
 
+    _fields = ('number', 'type', 'vat_rate', 'billing_datetime',
+               'paid_transaction_id', 'created_datetime')
+
 
 class Metadatum(CheddarObject):
     """An object for holding customer metadata."""
 
+    _fields = ('name', 'value', 'created_datetime', 'modified_datetime')
+
 
 class Transaction(CheddarObject):
     """An object representing a CheddarGetter transaction."""
 
+    _fields = ('parent_id', 'gateway_id', 'amount', 'memo', 'response',
+               'response_reason', 'is_refund', 'is_chargeback', 'is_chargeback_reversal',
+               'transacted_datetime', 'created_datetime')
+
+
+# every known field is preloaded into the key conversion tables
+preload_keys(key for klass in (Plan, Customer, Subscription, Item, Promotion, Charge,
+                               Coupon, Incentive, Invoice, Metadatum, Transaction)
+             for key in klass._fields)
+
 
 # if we are using Django, and if the appropriate settings
 # are already set in Django, just import them automatically
@@ -0,0 +1,202 @@
+# vim: set fileencoding=utf-8 :
+"""Record real CheddarGetter traffic to a cassette file, and replay it
+offline -- optionally with simulated latency and injected faults -- for
+deterministic load testing of code built on pycheddar.
+
+    >>> with Recorder('billing.cassette'):
+    ...     run_billing_flows()
+
+    >>> rng = random.Random(42)
+    >>> with Replayer('billing.cassette', latency=lambda: rng.lognormvariate(-3, 0.5),
+    ...               faults={'timeout': 0.001, 422: 0.002, 502: 0.002}, seed=42):
+    ...     run_billing_flows()
+
+Credentials are never written to the cassette."""
+
+import io
+import json
+import random
+import time
+import zlib
+import requests
+from .exceptions import NoRecordedResponse
+
+
+def _key(url, data):
+    """Return the key identifying a request: its path, and its POST data."""
+
+    path = url.split('/xml/', 1)[-1]
+    return (path, tuple(sorted((str(key), str(value)) for key, value in (data or {}).items())))
+
+
+def load(path):
+    """Load the interactions recorded in a cassette file, as a list of
+    (url path, data, status code, body) tuples."""
+
+    with open(path, 'rb') as cassette:
+        raw = json.loads(zlib.decompress(cassette.read()).decode('utf-8'))
+
+    return [(i['path'], tuple(tuple(pair) for pair in i['data']), i['status'], i['body'].encode('latin-1'))
+            for i in raw]
+
+
+def save(path, interactions):
+    """Write interactions, as returned by load, to a cassette file."""
+
+    raw = [{'path': path_, 'data': [list(pair) for pair in data], 'status': status, 'body': body.decode('latin-1')}
+           for path_, data, status, body in interactions]
+
+    with open(path, 'wb') as cassette:
+        cassette.write(zlib.compress(json.dumps(raw, separators=(',', ':')).encode('utf-8'), 9))
+
+
+class _Transport(object):
+    """Base class for transports, which stand in for requests.post when
+    installed as CheddarGetter.transport. Transports are context managers
+    that install themselves for the duration of the block."""
+
+    def __enter__(self):
+        from . import CheddarGetter
+
+        self._previous = CheddarGetter.transport
+        CheddarGetter.transport = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        from . import CheddarGetter
+
+        CheddarGetter.transport = self._previous
+
+
+class Recorder(_Transport):
+    """A transport that sends every request to CheddarGetter for real,
+    and records it alongside its response.
+
+    Requests that fail without a response (timeouts, connection errors)
+    are not recorded. The cassette is written when the block exits, or
+    when save() is called."""
+
+    def __init__(self, path = None):
+        self.path = path
+        self.interactions = []
+
+    def post(self, url, auth = None, data = None, timeout = None, stream = False):
+        response = requests.post(url, auth=auth, data=data, timeout=timeout, stream=stream)
+
+        path, items = _key(url, data)
+        self.interactions.append((path, items, response.status_code, response.content))
+
+        # recording has read the body; hand back a response that can
+        # still be read from the start, even by callers that stream it
+        return ReplayedResponse(url, response.status_code, response.content)
+
+    def save(self, path = None):
+        """Write everything recorded so far to the cassette file."""
+
+        save(path or self.path, self.interactions)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        super(Recorder, self).__exit__(exc_type, exc_value, traceback)
+        if self.path is not None:
+            self.save()
+
+
+class ReplayedResponse(object):
+    """The parts of a requests response that pycheddar uses."""
+
+    __slots__ = ('url', 'status_code', 'content')
+
+    def __init__(self, url, status_code, content):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+
+    @property
+    def raw(self):
+        stream = io.BytesIO(self.content)
+        stream.decode_content = True
+        return stream
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError('{0} Error'.format(self.status_code), response=self)
+
+
+class Replayer(_Transport):
+    """A transport that answers requests from recorded interactions,
+    entirely in memory and without touching the network.
+
+    Requests are matched on their path and POST data. When the same request
+    was recorded more than once, the responses are served in recorded order,
+    starting over once they run out. A request that was never recorded
+    raises NoRecordedResponse.
+
+    latency may be a number of seconds, or a callable returning one, to
+    delay each response; delays longer than the request's timeout raise
+    Timeout after waiting the timeout, as a real request would.
+
+    faults maps a fault to the probability of injecting it on any request:
+    "timeout" and "connection" raise the matching exception, and an HTTP
+    status code (such as 422 or 502) returns an error response with that
+    status. seed makes the injected faults reproducible."""
+
+    def __init__(self, path = None, interactions = None, latency = None, faults = None, seed = None,
+                 sleep = time.sleep):
+        if interactions is None:
+            interactions = load(path)
+
+        self._responses = {}
+        for path_, data, status, body in interactions:
+            self._responses.setdefault((path_, data), []).append((status, body))
+        self._positions = dict((key, 0) for key in self._responses)
+
+        self._latency = latency
+        self._faults = sorted((faults or {}).items(), key=lambda fault: str(fault[0]))
+        self._random = random.Random(seed)
+        self._sleep = sleep
+        self.calls = 0
+
+    def _delay(self, timeout):
+        latency = self._latency() if callable(self._latency) else self._latency
+        if not latency:
+            return
+
+        if timeout is not None and latency > timeout:
+            self._sleep(timeout)
+            raise requests.exceptions.Timeout('Simulated latency of {0:.3f}s'.format(latency))
+        self._sleep(latency)
+
+    def _fault(self, url):
+        for fault, probability in self._faults:
+            if self._random.random() >= probability:
+                continue
+
+            if fault == 'timeout':
+                raise requests.exceptions.Timeout('Injected timeout')
+            if fault == 'connection':
+                raise requests.exceptions.ConnectionError('Injected connection error')
+            return ReplayedResponse(url, int(fault), b'<error code="' + str(fault).encode('ascii') +
+                                    b'">Injected fault</error>')
+
+        return None
+
+    def post(self, url, auth = None, data = None, timeout = None, stream = False):
+        self.calls += 1
+
+        key = _key(url, data)
+        responses = self._responses.get(key)
+        if responses is None:
+            raise NoRecordedResponse('No recorded response for {0}'.format(key[0]))
+
+        if self._latency is not None:
+            self._delay(timeout)
+
+        if self._faults:
+            injected = self._fault(url)
+            if injected is not None:
+                return injected
+
+        position = self._positions[key]
+        self._positions[key] = (position + 1) % len(responses)
+        status, body = responses[position]
+        return ReplayedResponse(url, status, body)
@@ -0,0 +1,128 @@
+# vim: set fileencoding=utf-8 :
+
+import gc
+import mmap
+from xml.etree.ElementTree import fromstring, tostring
+
+
+class Catalog(object):
+    """A read-only snapshot of product-wide objects (plans and promotions).
+
+    The raw XML of every object is packed into a single anonymous memory map,
+    with only a small offset table kept as Python objects. When the catalog is
+    built in a master process before forking, workers share those pages instead
+    of each holding a copy; reference count updates in the workers never touch
+    them.
+
+    Each worker decodes an object the first time it is asked for, and reuses
+    that instance afterward. Objects returned from the catalog are shared
+    between callers in the same process, and should be treated as read-only."""
+
+    def __init__(self, entries):
+        """Build the catalog from a dictionary mapping class names to
+        lists of (code, id, xml bytes) tuples."""
+
+        size = sum(len(xml) for objects in entries.values() for code, id, xml in objects)
+        self._buffer = mmap.mmap(-1, max(size, 1))
+        self._offsets = {}
+        self._order = {}
+        self._cache = {}
+
+        offset = 0
+        for class_name, objects in entries.items():
+            self._order[class_name] = []
+            for code, id, xml in objects:
+                self._buffer[offset:offset + len(xml)] = xml
+                location = (offset, len(xml))
+                offset += len(xml)
+
+                self._order[class_name].append(location)
+                for key in (code, id):
+                    if key is not None:
+                        self._offsets[(class_name, key)] = location
+
+    def __contains__(self, class_name):
+        """Return whether objects of the named class are held in this catalog."""
+
+        return class_name in self._order
+
+    def _decode(self, klass, location, only = None):
+        offset, length = location
+
+        # projected objects are built fresh, and never cached
+        if only is not None:
+            return klass.from_xml(fromstring(self._buffer[offset:offset + length]), only=only)
+
+        if location not in self._cache:
+            self._cache[location] = klass.from_xml(fromstring(self._buffer[offset:offset + length]))
+        return self._cache[location]
+
+    def get(self, klass, code, only = None):
+        """Return the object of class klass with the given code or ID,
+        or None if the catalog does not have it.
+
+        If only is sent (a compiled projection), a new object hydrating
+        just those fields is returned instead of the shared one."""
+
+        location = self._offsets.get((klass.__name__, str(code)))
+        if location is None:
+            return None
+        return self._decode(klass, location, only)
+
+    def discard(self, klass, code):
+        """Forget the object of class klass with the given code or ID, so
+        that later lookups go to CheddarGetter. This only affects the
+        catalog in the current process."""
+
+        location = self._offsets.get((klass.__name__, str(code)))
+        if location is None:
+            return
+
+        for key, value in list(self._offsets.items()):
+            if value == location:
+                del self._offsets[key]
+        self._order[klass.__name__].remove(location)
+        self._cache.pop(location, None)
+
+    def all(self, klass):
+        """Return every object of class klass in the catalog."""
+
+        return [self._decode(klass, location) for location in self._order[klass.__name__]]
+
+
+def preload(classes = None, freeze = False):
+    """Fetch the product's plans and promotions once and install them
+    as CheddarGetter.catalog, so that Plan.get, Plan.all and their
+    Promotion equivalents are answered without a request.
+
+    Call this in the master process before workers are forked (for instance
+    from a gunicorn "on_starting" hook, or at import time with preload_app).
+    If freeze is True, the garbage collector is told to leave every object
+    that exists at this point alone, so that collections in the workers do
+    not copy the master's pages either. This is off by default, because
+    frozen objects are never collected."""
+
+    from . import CheddarGetter, NotFound, Plan, Promotion
+
+    if classes is None:
+        classes = (Plan, Promotion)
+
+    entries = {}
+    for klass in classes:
+        tag = klass.__name__.lower()
+        try:
+            xml = CheddarGetter.request('/{0}s/get/'.format(tag))
+        except NotFound:
+            entries[klass.__name__] = []
+            continue
+
+        entries[klass.__name__] = [(obj_xml.get('code'), obj_xml.get('id'), tostring(obj_xml))
+                                   for obj_xml in xml.iter(tag=tag)]
+
+    CheddarGetter.catalog = Catalog(entries)
+
+    if freeze and hasattr(gc, 'freeze'):
+        gc.collect()
+        gc.freeze()
+
+    return CheddarGetter.catalog
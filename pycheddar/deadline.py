@@ -0,0 +1,88 @@
+# vim: set fileencoding=utf-8 :
+
+import functools
+import threading
+import time
+from .exceptions import Timeout
+
+# each thread keeps its own stack of absolute expiry times
+_local = threading.local()
+
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+class Deadline(object):
+    """A context manager giving everything run inside it an overall time
+    budget, in seconds. Each request sent to CheddarGetter within the block
+    is given only the time that remains, and once the budget is spent further
+    requests fail immediately with Timeout.
+
+    Deadlines nest; an inner deadline can only shorten the outer one.
+
+        >>> with Deadline(2.5):
+        ...     customer = Customer.get('MY_CODE')
+        ...     customer.subscription.plan_code = 'PRO'
+        ...     customer.save()"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def __enter__(self):
+        stack = _stack()
+        expires = time.monotonic() + self.seconds
+        if stack and stack[-1] < expires:
+            expires = stack[-1]
+        stack.append(expires)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _stack().pop()
+
+    def remaining(self):
+        """Return the number of seconds left in this deadline."""
+
+        return remaining()
+
+
+def remaining():
+    """Return the number of seconds left in the innermost active deadline
+    in this thread, or None if there is no deadline."""
+
+    stack = _stack()
+    if not stack:
+        return None
+    return stack[-1] - time.monotonic()
+
+
+def request_timeout(timeout):
+    """Return the timeout to give the next request: the smaller of timeout
+    and whatever remains of the active deadline. Raise Timeout if the
+    deadline has already passed."""
+
+    left = remaining()
+    if left is None:
+        return timeout
+    if left <= 0:
+        raise Timeout('Deadline exceeded before the request could be sent.')
+    return min(timeout, left)
+
+
+def budgeted(method):
+    """Decorate a method so that it accepts a deadline keyword argument,
+    giving the whole call (however many requests it makes) that many
+    seconds to complete."""
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        seconds = kwargs.pop('deadline', None)
+        if seconds is None:
+            return method(*args, **kwargs)
+
+        with Deadline(seconds):
+            return method(*args, **kwargs)
+
+    return wrapper
@@ -16,7 +16,7 @@ class MouseTrap(Exception):
             return ''
 
     def __str__(self):
-        return str(self).encode('utf-8')
+        return self.__unicode__()
 
 
 class NotFound(MouseTrap):
@@ -57,3 +57,15 @@ class Timeout(MouseTrap):
 
 class ConnectionError(MouseTrap):
     pass
+
+
+class FieldNotLoaded(MouseTrap, AttributeError):
+    pass
+
+
+class NoRecordedResponse(MouseTrap):
+    pass
+
+
+class CircuitOpen(ConnectionError):
+    pass
@@ -0,0 +1,287 @@
+# vim: set fileencoding=utf-8 :
+"""Stream customers, invoices or transactions from CheddarGetter straight
+to CSV or NDJSON files, in constant memory.
+
+From the command line:
+
+    $ python -m pycheddar.export customers customers.csv \\
+          --since 2010-01-01 --chunk-days 30 --workers 4 --resume
+
+Credentials and the product code are read from the CHEDDARGETTER_USERNAME,
+CHEDDARGETTER_PASSWORD and CHEDDARGETTER_PRODUCT_CODE environment variables
+unless they are given as options."""
+
+import argparse
+import csv
+import datetime
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree.ElementTree import ParseError, iterparse
+from . import CheddarGetter, Customer, Invoice, NotFound, Transaction, UnexpectedResponse
+from .utils import to_underscores
+
+# the columns written for each kind of row; the first few are not
+# CheddarGetter fields of the object, but context from its parents
+COLUMNS = {
+    'customers': ('id', 'code') + Customer._fields + ('plan_code', 'canceled_datetime'),
+    'invoices': ('id', 'customer_code', 'plan_code') + Invoice._fields,
+    'transactions': ('id', 'customer_code', 'invoice_id') + Transaction._fields,
+}
+
+FORMATS = ('csv', 'ndjson')
+
+
+def _leaves(element):
+    """Return a dictionary of the underscored tags and text of the
+    element's children that have no children of their own."""
+
+    return dict((to_underscores(child.tag), child.text) for child in element if not len(child))
+
+
+def _plan_code(subscription):
+    """Return the code of the subscription element's plan, if any."""
+
+    plan = subscription.find('plans/plan') if subscription is not None else None
+    return plan.get('code') if plan is not None else None
+
+
+def _rows(kind, customer):
+    """Yield the rows of the given kind found in one customer element."""
+
+    if kind == 'customers':
+        subscription = customer.find('subscriptions/subscription')
+        row = _leaves(customer)
+        row['id'] = customer.get('id')
+        row['code'] = customer.get('code')
+        row['plan_code'] = _plan_code(subscription)
+        row['canceled_datetime'] = subscription.findtext('canceledDatetime') if subscription is not None else None
+        yield row
+        return
+
+    for subscription in customer.iterfind('subscriptions/subscription'):
+        # each invoice belongs to the plan of its own subscription, which
+        # is not necessarily the customer's current one
+        plan_code = _plan_code(subscription)
+
+        for invoice in subscription.iterfind('invoices/invoice'):
+            if kind == 'invoices':
+                row = _leaves(invoice)
+                row['id'] = invoice.get('id')
+                row['customer_code'] = customer.get('code')
+                row['plan_code'] = plan_code
+                yield row
+                continue
+
+            for transaction in invoice.iterfind('transactions/transaction'):
+                row = _leaves(transaction)
+                row['id'] = transaction.get('id')
+                row['customer_code'] = customer.get('code')
+                row['invoice_id'] = invoice.get('id')
+                yield row
+
+
+def stream(kind = 'customers', **filters):
+    """Yield rows (as dictionaries) of the given kind -- "customers",
+    "invoices" or "transactions" -- for every customer matching the
+    filters, which are sent to customers/get as-is.
+
+    The response is parsed incrementally, and each customer is discarded
+    once its rows have been produced, so memory use does not grow with
+    the size of the product."""
+
+    if kind not in COLUMNS:
+        raise ValueError('Unknown export kind "{0}".'.format(kind))
+
+    url, data = CheddarGetter._prepare('/customers/get/', **filters)
+    try:
+        response = CheddarGetter._send(url, data, stream=True)
+    except NotFound:
+        return
+
+    response.raw.decode_content = True
+    root = None
+    parser = iterparse(response.raw, events=('start', 'end'))
+    while True:
+        try:
+            event, element = next(parser)
+        except StopIteration:
+            break
+        except ParseError as e:
+            raise UnexpectedResponse("The server sent back something that wasn't valid XML.",
+                                     response=response, parent_exception=e)
+
+        if root is None:
+            root = element
+        elif event == 'end' and element.tag == 'customer':
+            for row in _rows(kind, element):
+                yield row
+
+            # let go of everything parsed so far
+            root.clear()
+
+
+class _Writer(object):
+    """Writes rows to a file in one of the supported formats."""
+
+    def __init__(self, fileobj, kind, format):
+        self._file = fileobj
+        self._format = format
+        if format == 'csv':
+            self._csv = csv.DictWriter(fileobj, COLUMNS[kind], extrasaction='ignore')
+            self._csv.writeheader()
+
+    def write(self, row):
+        if self._format == 'csv':
+            self._csv.writerow(row)
+        else:
+            self._file.write(json.dumps(row, sort_keys=True))
+            self._file.write('\n')
+
+
+def export_file(path, kind = 'customers', format = 'csv', **filters):
+    """Stream rows of the given kind into a single file at path.
+    Return the number of rows written."""
+
+    if format not in FORMATS:
+        raise ValueError('Unknown export format "{0}".'.format(format))
+
+    count = 0
+    with open(path, 'w', newline='') as fileobj:
+        writer = _Writer(fileobj, kind, format)
+        for row in stream(kind, **filters):
+            writer.write(row)
+            count += 1
+
+    return count
+
+
+def date_ranges(since, until, days):
+    """Split the dates from since to until (inclusive) into consecutive
+    ranges of at most the given number of days. Return a list of
+    (first, last) date string tuples."""
+
+    if days < 1:
+        raise ValueError('Ranges must be at least one day long, not {0}.'.format(days))
+
+    since = datetime.datetime.strptime(since, '%Y-%m-%d').date()
+    until = datetime.datetime.strptime(until, '%Y-%m-%d').date()
+
+    ranges = []
+    while since <= until:
+        last = min(since + datetime.timedelta(days=days - 1), until)
+        ranges.append((since.isoformat(), last.isoformat()))
+        since = last + datetime.timedelta(days=1)
+
+    return ranges
+
+
+def export(path, kind = 'customers', format = 'csv', ranges = None, workers = 1, resume = False,
+           report = None, **filters):
+    """Export rows of the given kind to path.
+
+    Without ranges, everything is written to path in one pass. With ranges --
+    a list of (first, last) creation date tuples, see date_ranges -- each range
+    is fetched separately (up to workers at a time) into its own numbered part
+    file next to path, and a ".done" marker is written beside each part as it
+    completes. With resume, parts that are already done are skipped.
+
+    If report is a callable, it is sent a line of progress text as each part
+    completes. Return a dictionary with the number of rows written, the
+    elapsed time in seconds and the throughput in rows per second."""
+
+    started = time.time()
+
+    def finish(rows):
+        elapsed = time.time() - started
+        rate = rows / elapsed if elapsed else 0.0
+        if report is not None:
+            report('wrote {0} rows in {1:.1f}s ({2:.0f} rows/s)'.format(rows, elapsed, rate))
+        return {'rows': rows, 'seconds': elapsed, 'rows_per_second': rate}
+
+    if not ranges:
+        return finish(export_file(path, kind, format, **filters))
+
+    base, ext = os.path.splitext(path)
+
+    def part(index, first, last):
+        part_path = '{0}.{1:05d}{2}'.format(base, index, ext)
+        if resume and os.path.exists(part_path + '.done'):
+            return 0
+
+        part_filters = dict(filters, created_after_date=first, created_before_date=last)
+        rows = export_file(part_path, kind, format, **part_filters)
+
+        with open(part_path + '.done', 'w') as marker:
+            marker.write('{0}\n'.format(rows))
+        if report is not None:
+            report('{0}: {1} rows ({2} to {3})'.format(part_path, rows, first, last))
+        return rows
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        counts = pool.map(lambda args: part(*args), [(i, first, last) for i, (first, last) in enumerate(ranges)])
+        return finish(sum(counts))
+
+
+def _positive(value):
+    """Parse a command line argument as a whole number of at least 1."""
+
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError('must be at least 1, not {0}'.format(number))
+    return number
+
+
+def main(argv = None):
+    """Run the export from the command line."""
+
+    parser = argparse.ArgumentParser(prog='python -m pycheddar.export',
+                                     description='Stream CheddarGetter data to CSV or NDJSON.')
+    parser.add_argument('kind', choices=sorted(COLUMNS))
+    parser.add_argument('path')
+    parser.add_argument('--format', choices=FORMATS,
+                        help='output format (default: from the file extension, else csv)')
+    parser.add_argument('--since', help='first customer creation date to export (YYYY-MM-DD)')
+    parser.add_argument('--until', default=datetime.date.today().isoformat(),
+                        help='last customer creation date to export (default: today)')
+    parser.add_argument('--chunk-days', type=_positive,
+                        help='split the export into parts of this many days of customer creation dates')
+    parser.add_argument('--workers', type=_positive, help='parts to fetch at once (default: 1)')
+    parser.add_argument('--resume', action='store_true', help='skip parts that are already done')
+    parser.add_argument('--username', default=os.environ.get('CHEDDARGETTER_USERNAME'))
+    parser.add_argument('--password', default=os.environ.get('CHEDDARGETTER_PASSWORD'))
+    parser.add_argument('--product-code', default=os.environ.get('CHEDDARGETTER_PRODUCT_CODE'))
+    args = parser.parse_args(argv)
+
+    if args.username and args.password:
+        CheddarGetter.credentials = (args.username, args.password)
+    if args.product_code:
+        CheddarGetter.product_code = args.product_code
+
+    format = args.format
+    if format is None:
+        format = 'ndjson' if args.path.endswith(('.ndjson', '.jsonl')) else 'csv'
+
+    if args.workers is not None and not args.chunk_days:
+        parser.error('--workers requires --chunk-days')
+
+    ranges = None
+    filters = {}
+    if args.chunk_days is not None:
+        if not args.since:
+            parser.error('--chunk-days requires --since')
+        ranges = date_ranges(args.since, args.until, args.chunk_days)
+    elif args.since:
+        filters = {'created_after_date': args.since, 'created_before_date': args.until}
+
+    def report(line):
+        sys.stderr.write(line + '\n')
+
+    export(args.path, args.kind, format, ranges=ranges, workers=args.workers or 1,
+           resume=args.resume, report=report, **filters)
+
+
+if __name__ == '__main__':
+    main()
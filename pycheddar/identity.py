@@ -0,0 +1,61 @@
+# vim: set fileencoding=utf-8 :
+
+
+def _freeze(projection):
+    """Return a hashable form of a compiled field projection."""
+
+    if projection is None:
+        return None
+    return tuple(sorted((key, _freeze(value)) for key, value in projection.items()))
+
+
+class IdentityMap(object):
+    """Interns objects that many others share -- plans, the items defined on
+    plans, and promotions -- so that every occurrence of the same ID within
+    a fetch (or across every fetch using the same map) is one instance.
+
+    Pass one to TopCheddarObject.fetch as identity_map, or assign one to
+    CheddarGetter.identity_map to share it across every fetch.
+
+    Interned objects are shared, and should be treated as read-only. They
+    have no parent relationship (a shared plan has no "subscription"),
+    except to a parent that is shared too (an item defined on a plan keeps
+    its "plan").
+
+    A map that lives across fetches holds on to objects as they were when
+    first loaded. Fetching them directly (Plan.all(), Plan.get(code))
+    replaces them with fresh copies; discard forgets a single object, and
+    clear forgets everything."""
+
+    def __init__(self):
+        self._objects = {}
+
+    def _key(self, klass, id, projection):
+        return (klass.__name__, id, _freeze(projection))
+
+    def get(self, klass, id, projection = None):
+        """Return the interned object of class klass with the given ID
+        and projection, or None if there is not one yet."""
+
+        return self._objects.get(self._key(klass, id, projection))
+
+    def add(self, obj, projection = None):
+        """Intern an object, keyed by its class, ID and projection."""
+
+        self._objects[self._key(obj.__class__, obj._id, projection)] = obj
+        return obj
+
+    def discard(self, klass, id):
+        """Forget the interned object of class klass with the given ID,
+        whatever its projection."""
+
+        for key in [key for key in self._objects if key[:2] == (klass.__name__, id)]:
+            del self._objects[key]
+
+    def clear(self):
+        """Forget every interned object."""
+
+        self._objects.clear()
+
+    def __len__(self):
+        return len(self._objects)
@@ -0,0 +1,137 @@
+# vim: set fileencoding=utf-8 :
+
+import re
+from concurrent.futures import ProcessPoolExecutor
+from xml.etree.ElementTree import fromstring
+from .exceptions import UnexpectedResponse
+
+# responses smaller than this are not worth the overhead
+# of a process pool; decode them in-process instead
+MIN_PARALLEL_BYTES = 4 * 1024 * 1024
+
+# how many chunks to hand to each worker process; more than one
+# keeps the pool balanced when some objects are much larger than others
+CHUNKS_PER_PROCESS = 4
+
+
+class Node(object):
+    """A lightweight stand-in for an ElementTree element, built from
+    the nested tuples sent back by the decoding processes.
+
+    It implements only the part of the element interface that
+    CheddarObject._load_data_from_xml relies on."""
+
+    __slots__ = ('_raw',)
+
+    def __init__(self, raw):
+        self._raw = raw
+
+    @property
+    def tag(self):
+        return self._raw[0]
+
+    @property
+    def attrib(self):
+        return self._raw[1] or {}
+
+    @property
+    def text(self):
+        return self._raw[2]
+
+    def get(self, key, default = None):
+        """Return an attribute of this node."""
+
+        if not self._raw[1]:
+            return default
+        return self._raw[1].get(key, default)
+
+    def iter(self, tag = None):
+        """Iterate over this node and all of its descendants,
+        optionally limited to those with the given tag."""
+
+        if tag is None or self._raw[0] == tag:
+            yield self
+        for child in self._raw[3]:
+            for node in Node(child).iter(tag):
+                yield node
+
+    def __iter__(self):
+        return (Node(child) for child in self._raw[3])
+
+    def __len__(self):
+        return len(self._raw[3])
+
+
+def _to_tuple(element):
+    """Convert an element into the compact (tag, attrib, text, children)
+    form that is cheap to pickle between processes."""
+
+    children = tuple(_to_tuple(child) for child in element)
+
+    # text on elements with children is only whitespace; drop it
+    text = element.text if not children else None
+
+    return (element.tag, element.attrib or None, text, children)
+
+
+def _decode_chunk(args):
+    """Decode one chunk of a response in a worker process."""
+
+    content, tag = args
+    return [_to_tuple(element) for element in fromstring(content).iter(tag)]
+
+
+def split(content, tag, chunks):
+    """Split a raw response into at most `chunks` well-formed documents,
+    breaking only at the boundaries of top-level `tag` elements."""
+
+    btag = tag.encode('ascii')
+    starts = [m.start() for m in re.finditer(b'<' + btag + br'[\s>/]', content)]
+    if not starts:
+        return []
+
+    end = content.rfind(b'</' + btag + b'>')
+    end = len(content) if end < starts[-1] else end + len(btag) + 3
+
+    # distribute the elements evenly across the chunks
+    per_chunk = max(1, -(-len(starts) // chunks))
+    bounds = starts[::per_chunk] + [end]
+
+    wrapper_open = b'<' + btag + b's>'
+    wrapper_close = b'</' + btag + b's>'
+    return [wrapper_open + content[bounds[i]:bounds[i + 1]] + wrapper_close
+            for i in range(len(bounds) - 1)]
+
+
+def worthwhile(content, processes):
+    """Return whether decode would spread a response of this size
+    across a process pool, rather than decoding it in-process."""
+
+    return processes > 1 and len(content) >= MIN_PARALLEL_BYTES
+
+
+def decode(content, tag, processes):
+    """Decode every `tag` element in a raw CheddarGetter response,
+    spreading the XML parsing across `processes` worker processes.
+
+    Return a list of Node objects, in document order, suitable for
+    passing to CheddarObject.from_xml."""
+
+    try:
+        # small responses (and error responses) are decoded in-process
+        if not worthwhile(content, processes):
+            xml = fromstring(content)
+            if xml.tag == 'error':
+                raise UnexpectedResponse(xml.text)
+            return [Node(_to_tuple(element)) for element in xml.iter(tag)]
+
+        chunks = split(content, tag, processes * CHUNKS_PER_PROCESS)
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            results = pool.map(_decode_chunk, [(chunk, tag) for chunk in chunks])
+            return [Node(raw) for result in results for raw in result]
+
+    except UnexpectedResponse:
+        raise
+    except Exception as e:
+        raise UnexpectedResponse("The server sent back something that wasn't valid XML.",
+                                 parent_exception=e)
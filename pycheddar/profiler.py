@@ -0,0 +1,215 @@
+# vim: set fileencoding=utf-8 :
+
+import heapq
+import itertools
+import json
+import threading
+import time
+from xml.etree.ElementTree import tostring
+
+# each thread has its own active profiler, if any
+_local = threading.local()
+
+
+def current():
+    """Return the HydrationProfiler active in this thread, or None."""
+
+    return getattr(_local, 'profiler', None)
+
+
+class _Stats(object):
+    """Counters for one class, relationship or phase."""
+
+    __slots__ = ('count', 'seconds', 'own_seconds', 'bytes')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.own_seconds = 0.0
+        self.bytes = 0
+
+    def as_dict(self):
+        return {'count': self.count, 'seconds': self.seconds,
+                'own_seconds': self.own_seconds, 'bytes': self.bytes}
+
+
+class HydrationProfiler(object):
+    """Attributes the cost of loading objects to the network, XML parsing,
+    and each class and relationship that is hydrated.
+
+        >>> with HydrationProfiler() as profile:
+        ...     customers = Customer.all()
+        >>> print(profile.report())
+        >>> profile.dump('hydration.json')
+
+    For every class, it counts the objects created, the time spent building
+    them (in total, and excluding their children) and the size of their XML.
+    The same is kept for every parent -> child relationship, and the top
+    heaviest objects fetched directly (usually customers) are remembered.
+
+    Lazily loaded relationships (such as a subscription's invoices) are left
+    out of their parent's time and size, and recorded under the relationship
+    when they are loaded, if that happens within the profiler.
+
+    Measuring XML sizes means serializing every subtree; the time this takes
+    is left out of the timings, but pass measure_bytes = False to skip it
+    altogether. The profiler only sees work done in the thread it was
+    entered in."""
+
+    def __init__(self, top = 10, measure_bytes = True):
+        self.top = top
+        self.measure_bytes = measure_bytes
+        self.phases = {}
+        self.classes = {}
+        self.relationships = {}
+        self.reused = 0
+        self._heaviest = []
+        self._stack = []
+        self._overhead = 0.0
+        self._sequence = itertools.count()
+
+    def __enter__(self):
+        self._previous = current()
+        _local.profiler = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _local.profiler = self._previous
+
+    def phase(self, name, seconds, size = 0):
+        """Record time spent (and bytes handled) in a phase outside of
+        hydration, such as "network" or "parse"."""
+
+        stats = self.phases.setdefault(name, _Stats())
+        stats.count += 1
+        stats.seconds += seconds
+        stats.own_seconds += seconds
+        stats.bytes += size
+
+    def _size(self, xml):
+        """Return the serialized size of an element, leaving the time it
+        takes out of the timings."""
+
+        if not self.measure_bytes or not hasattr(xml, 'makeelement'):
+            return 0
+
+        started = time.perf_counter()
+        size = len(tostring(xml))
+        self._overhead += time.perf_counter() - started
+        return size
+
+    def enter(self, klass, xml, parent):
+        """Note that an object of class klass is being built from xml.
+        Return a frame to pass to exit."""
+
+        size = self._size(xml)
+
+        relationship = None
+        if parent is not None:
+            relationship = '{0} -> {1}'.format(parent.__class__.__name__, klass.__name__)
+
+        frame = [klass.__name__, relationship, size, time.perf_counter(), self._overhead, 0.0]
+        self._stack.append(frame)
+        return frame
+
+    def defer(self, xml):
+        """Note that the children of xml are being kept raw, to be loaded
+        later; their size is left out of every object being built."""
+
+        size = self._size(xml)
+        for frame in self._stack:
+            frame[2] -= size
+
+    def exit(self, frame, obj):
+        """Note that the object for frame has been built, or that it failed
+        to load if obj is None."""
+
+        name, relationship, size, started, overhead, children = frame
+        seconds = time.perf_counter() - started - (self._overhead - overhead)
+
+        # frames left behind by objects that failed to load are dropped too
+        while self._stack and self._stack.pop() is not frame:
+            pass
+
+        if obj is None:
+            return
+
+        stats = self.classes.setdefault(name, _Stats())
+        stats.count += 1
+        stats.seconds += seconds
+        stats.own_seconds += seconds - children
+        stats.bytes += size
+
+        if relationship is not None:
+            stats = self.relationships.setdefault(relationship, _Stats())
+            stats.count += 1
+            stats.seconds += seconds
+            stats.own_seconds += seconds - children
+            stats.bytes += size
+
+        if self._stack:
+            self._stack[-1][5] += seconds
+        elif relationship is None:
+            entry = (seconds, next(self._sequence), size, name, obj._code or obj._id)
+            if len(self._heaviest) < self.top:
+                heapq.heappush(self._heaviest, entry)
+            else:
+                heapq.heappushpop(self._heaviest, entry)
+
+    def reuse(self):
+        """Note an object that was reused from an identity map instead of built."""
+
+        self.reused += 1
+
+    def heaviest(self):
+        """Return the heaviest objects fetched directly, heaviest first, as
+        (seconds, bytes, class name, code) tuples."""
+
+        return [(seconds, size, name, code) for seconds, sequence, size, name, code
+                in sorted(self._heaviest, reverse=True)]
+
+    def as_dict(self):
+        """Return everything recorded, in a form suitable for JSON."""
+
+        return {
+            'phases': dict((name, stats.as_dict()) for name, stats in self.phases.items()),
+            'classes': dict((name, stats.as_dict()) for name, stats in self.classes.items()),
+            'relationships': dict((name, stats.as_dict()) for name, stats in self.relationships.items()),
+            'reused': self.reused,
+            'heaviest': [{'seconds': seconds, 'bytes': size, 'class': name, 'code': code}
+                         for seconds, size, name, code in self.heaviest()],
+        }
+
+    def dump(self, path = None):
+        """Return everything recorded as JSON, also writing it to path if given."""
+
+        data = json.dumps(self.as_dict(), indent=2, sort_keys=True)
+        if path is not None:
+            with open(path, 'w') as fileobj:
+                fileobj.write(data)
+        return data
+
+    def report(self):
+        """Return a human readable report of everything recorded."""
+
+        def table(title, rows):
+            lines = ['', title, '{0:<36} {1:>9} {2:>10} {3:>10} {4:>12}'.format(
+                '', 'count', 'total ms', 'own ms', 'bytes')]
+            for name, stats in sorted(rows.items(), key=lambda row: row[1].seconds, reverse=True):
+                lines.append('{0:<36} {1:>9} {2:>10.1f} {3:>10.1f} {4:>12}'.format(
+                    name, stats.count, stats.seconds * 1000, stats.own_seconds * 1000, stats.bytes))
+            return lines
+
+        lines = ['Hydration profile']
+        lines += table('Phases', self.phases)
+        lines += table('Classes', self.classes)
+        lines += table('Relationships', self.relationships)
+
+        if self.reused:
+            lines += ['', 'Objects reused from an identity map: {0}'.format(self.reused)]
+
+        lines += ['', 'Heaviest objects', '{0:<36} {1:>10} {2:>12}'.format('', 'ms', 'bytes')]
+        for seconds, size, name, code in self.heaviest():
+            lines.append('{0:<36} {1:>10.1f} {2:>12}'.format('{0} {1}'.format(name, code), seconds * 1000, size))
+
+        return '\n'.join(lines)
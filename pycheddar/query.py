@@ -0,0 +1,306 @@
+# vim: set fileencoding=utf-8 :
+
+import heapq
+from bisect import bisect_left, bisect_right
+
+
+def _email_domain(customer):
+    email = customer._data.get('email')
+    if not email or '@' not in email:
+        return None
+    return email.rsplit('@', 1)[1].lower()
+
+
+def _subscription_value(key):
+    def extract(customer):
+        subscription = customer.__dict__.get('subscription')
+        if subscription is None:
+            return None
+        return subscription._data.get(key)
+    return extract
+
+
+def _plan_code(customer):
+    subscription = customer.__dict__.get('subscription')
+    if subscription is None or 'plan' not in subscription.__dict__:
+        return None
+    return subscription.plan._code
+
+
+def _status(customer):
+    subscription = customer.__dict__.get('subscription')
+    if subscription is None:
+        return None
+    return 'canceled' if subscription._data.get('canceled_datetime') else 'active'
+
+
+def _data_value(key):
+    def extract(customer):
+        if key == 'code':
+            return customer._code
+        if key == 'id':
+            return customer._id
+        return customer._data.get(key)
+    return extract
+
+
+# fields that are derived from somewhere other than the customer's
+# own data dictionary
+DERIVED_FIELDS = {
+    'email_domain': _email_domain,
+    'plan_code': _plan_code,
+    'status': _status,
+    'canceled_datetime': _subscription_value('canceled_datetime'),
+    'cancel_type': _subscription_value('cancel_type'),
+}
+
+# lookups understood in filter() keywords, Django style
+LOOKUPS = ('exact', 'in', 'gt', 'gte', 'lt', 'lte', 'isnull')
+
+# query values for these fields are normalized the same way as the
+# indexed values before they are compared
+NORMALIZE = {
+    'email_domain': lambda value: value.lower() if isinstance(value, str) else value,
+}
+
+
+def _sort_key(value):
+    """Return a key that orders values of mixed types without raising:
+    numbers first (in numeric order), then everything else as text.
+
+    Numeric-looking fields are converted to numbers when loaded, so one
+    column (a metadata key, say) may well hold both."""
+
+    if isinstance(value, (int, float)):
+        return (0, value)
+    return (1, str(value))
+
+
+class CustomerIndex(object):
+    """An in-memory query layer over a set of already loaded customers.
+
+    Equality indexes are kept for the common fields (email domain, plan code,
+    subscription status and every metadata key); indexes for any other field
+    are built the first time that field is queried, and reused afterward.
+
+    Filters use Django-like keywords:
+
+        >>> index = CustomerIndex(Customer.all())
+        >>> index.filter(email_domain='example.com', status='active')
+        >>> index.filter(meta__tier='gold').order_by('-created_datetime').limit(10)
+        >>> index.filter(canceled_datetime__gte='2012-01-01')
+
+    Metadata values are queried with the "meta__" prefix."""
+
+    def __init__(self, customers, fields = ('email_domain', 'plan_code', 'status')):
+        self.customers = list(customers)
+        self._values = {}
+        self._hashed = {}
+        self._sorted = {}
+
+        for field in fields:
+            self._hash_index(field)
+
+        # every customer's metadata is gathered once (customers fetched
+        # without it have none), and every key seen is indexed up front
+        self._meta = []
+        for customer in self.customers:
+            meta = {}
+            for datum in customer.__dict__.get('meta_data') or ():
+                meta.setdefault(datum.name, datum.value)
+            self._meta.append(meta)
+        for name in set(name for meta in self._meta for name in meta):
+            self._hash_index('meta__' + name)
+
+    def _extractor(self, field):
+        """Return a function that extracts the value of field from a customer."""
+
+        if field in DERIVED_FIELDS:
+            return DERIVED_FIELDS[field]
+        return _data_value(field)
+
+    def _column(self, field):
+        """Return the value of field for every customer, in order."""
+
+        if field not in self._values:
+            if field.startswith('meta__'):
+                name = field[6:]
+                self._values[field] = [meta.get(name) for meta in self._meta]
+            else:
+                extract = self._extractor(field)
+                self._values[field] = [extract(customer) for customer in self.customers]
+        return self._values[field]
+
+    def _hash_index(self, field):
+        """Return (building if necessary) the value -> positions index for field."""
+
+        if field not in self._hashed:
+            index = {}
+            for position, value in enumerate(self._column(field)):
+                index.setdefault(value, set()).add(position)
+            self._hashed[field] = index
+        return self._hashed[field]
+
+    def _sorted_index(self, field):
+        """Return (building if necessary) the sorted (values, positions)
+        index for field, leaving out customers with no value."""
+
+        if field not in self._sorted:
+            pairs = sorted((_sort_key(value), position) for position, value in enumerate(self._column(field))
+                           if value is not None)
+            self._sorted[field] = ([pair[0] for pair in pairs], [pair[1] for pair in pairs])
+        return self._sorted[field]
+
+    def _match(self, field, lookup, value):
+        """Return the set of positions matching a single filter condition."""
+
+        if field in NORMALIZE:
+            normalize = NORMALIZE[field]
+            value = [normalize(item) for item in value] if lookup == 'in' else normalize(value)
+
+        if lookup == 'exact':
+            return self._hash_index(field).get(value, set())
+
+        if lookup == 'in':
+            index = self._hash_index(field)
+            matches = set()
+            for item in value:
+                matches |= index.get(item, set())
+            return matches
+
+        if lookup == 'isnull':
+            nulls = self._hash_index(field).get(None, set())
+            if value:
+                return nulls
+            return set(range(len(self.customers))) - nulls
+
+        # range lookups only compare values of the same kind: numbers
+        # with numbers, and text with text
+        values, positions = self._sorted_index(field)
+        key = _sort_key(value)
+        first = bisect_left(values, (key[0],))
+        last = bisect_left(values, (key[0] + 1,))
+
+        if lookup == 'gt':
+            return set(positions[bisect_right(values, key, first, last):last])
+        if lookup == 'gte':
+            return set(positions[bisect_left(values, key, first, last):last])
+        if lookup == 'lt':
+            return set(positions[first:bisect_left(values, key, first, last)])
+        return set(positions[first:bisect_right(values, key, first, last)])
+
+    def _select(self, positions, **kwargs):
+        """Narrow the positions down to those matching every keyword filter."""
+
+        conditions = []
+        for key, value in kwargs.items():
+            field, lookup = key, 'exact'
+            if '__' in key:
+                head, tail = key.rsplit('__', 1)
+                if tail in LOOKUPS:
+                    field, lookup = head, tail
+            conditions.append(self._match(field, lookup, value))
+
+        # intersect starting from the most selective condition
+        conditions.sort(key=len)
+        if positions is not None:
+            conditions.insert(0, positions)
+        if not conditions:
+            return set(range(len(self.customers)))
+
+        result = set(conditions[0])
+        for condition in conditions[1:]:
+            result &= condition
+            if not result:
+                break
+        return result
+
+    def filter(self, **kwargs):
+        """Return a Query of the customers matching every keyword filter."""
+
+        return Query(self, self._select(None, **kwargs))
+
+    def all(self):
+        """Return a Query of every customer in the index."""
+
+        return Query(self, set(range(len(self.customers))))
+
+
+class Query(object):
+    """A lazily evaluated set of customers from a CustomerIndex,
+    which may be further filtered, ordered and limited."""
+
+    def __init__(self, index, positions, ordering = (), limit = None):
+        self._index = index
+        self._positions = positions
+        self._ordering = tuple(ordering)
+        self._limit = limit
+
+    def filter(self, **kwargs):
+        """Return a new Query, further narrowed by the keyword filters."""
+
+        return Query(self._index, self._index._select(self._positions, **kwargs),
+                     self._ordering, self._limit)
+
+    def order_by(self, *fields):
+        """Return a new Query ordered by the given fields; prefix a field
+        with "-" to sort in descending order. Customers with no value for
+        a field are always sorted last, and numbers sort before text."""
+
+        return Query(self._index, self._positions, fields, self._limit)
+
+    def limit(self, count):
+        """Return a new Query yielding at most count customers."""
+
+        return Query(self._index, self._positions, self._ordering, count)
+
+    def _ordered_positions(self):
+        positions = self._positions
+        if not self._ordering:
+            positions = sorted(positions)
+            return positions if self._limit is None else positions[:self._limit]
+
+        # sort by the least significant field first, relying on
+        # the sort being stable
+        positions = list(positions)
+        if self._limit is not None and len(self._ordering) == 1:
+            field = self._ordering[0]
+            reverse = field.startswith('-')
+            column = self._index._column(field.lstrip('-'))
+            present = [p for p in positions if column[p] is not None]
+            missing = sorted(p for p in positions if column[p] is None)
+            pick = heapq.nlargest if reverse else heapq.nsmallest
+            top = pick(self._limit, present, key=lambda p: (_sort_key(column[p]), -p if reverse else p))
+            return (top + missing)[:self._limit]
+
+        positions.sort()
+        for field in reversed(self._ordering):
+            reverse = field.startswith('-')
+            column = self._index._column(field.lstrip('-'))
+            present = [p for p in positions if column[p] is not None]
+            missing = [p for p in positions if column[p] is None]
+            present.sort(key=lambda p: _sort_key(column[p]), reverse=reverse)
+            positions = present + missing
+
+        return positions if self._limit is None else positions[:self._limit]
+
+    def __iter__(self):
+        customers = self._index.customers
+        return iter([customers[p] for p in self._ordered_positions()])
+
+    def __len__(self):
+        if self._limit is None:
+            return len(self._positions)
+        return min(self._limit, len(self._positions))
+
+    def count(self):
+        """Return the number of customers this query would yield."""
+
+        return len(self)
+
+    def first(self):
+        """Return the first matching customer, or None."""
+
+        for customer in self.limit(1):
+            return customer
+        return None
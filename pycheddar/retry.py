@@ -0,0 +1,228 @@
+# vim: set fileencoding=utf-8 :
+
+import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from . import deadline
+from .exceptions import CircuitOpen, ConnectionError, GatewayConnectionError, MouseTrap, Timeout
+
+# read endpoints, which are safe to send more than once
+IDEMPOTENT = re.compile(r'/xml/[^/]+/(get|list)(/|$)')
+
+
+class CircuitBreaker(object):
+    """Fails requests fast while CheddarGetter appears to be down.
+
+    After failure_threshold consecutive failures the circuit opens, and
+    requests raise CircuitOpen without being sent. Once reset_timeout
+    seconds have passed, a single trial request is let through; if it
+    succeeds the circuit closes again, otherwise it stays open."""
+
+    def __init__(self, failure_threshold = 5, reset_timeout = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Raise CircuitOpen if no request may be sent now. Otherwise return
+        True if the caller is the trial request of a half-open circuit (and
+        so must end it with success, failure or release), False if not."""
+
+        with self._lock:
+            if self._opened_at is None:
+                return False
+            if not self._trial and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._trial = True
+                return True
+        raise CircuitOpen('CheddarGetter is unavailable; failing fast.')
+
+    def success(self):
+        """Note a request that got a response from CheddarGetter."""
+
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def failure(self, trial = False):
+        """Note a request that failed to get a response; trial is what
+        allow returned for it."""
+
+        with self._lock:
+            self._failures += 1
+            if trial or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            if trial:
+                self._trial = False
+
+    def release(self):
+        """Give up the trial request, which ended without telling either
+        way, so that another trial may be sent. Only the trial request
+        may call this."""
+
+        with self._lock:
+            self._trial = False
+
+
+class RetryPolicy(object):
+    """Retries and hedges idempotent reads (the */get/ and */list/ endpoints)
+    to cut tail latency. Install one as CheddarGetter.retry_policy.
+
+    Reads failing with one of the retry_on exceptions are retried up to
+    attempts times in all, after an exponential backoff with full jitter
+    (from backoff seconds, doubling, capped at max_backoff).
+
+    If hedge_percentile is set (e.g. 95), a second, hedged copy of a read is
+    sent when the first has taken longer than that percentile of recent read
+    latencies; whichever answers first is used. Hedging starts once
+    hedge_min_samples latencies have been seen.
+
+    Retries and hedges both draw from a budget: each read adds budget_ratio
+    of a token, up to budget_max, and each extra request spends a whole one.
+    This keeps a struggling service from being sent a flood of retries.
+
+    Writes are never retried or hedged. If a CircuitBreaker is given as
+    breaker, it guards every request, reads and writes alike, and the time
+    spent never exceeds an active Deadline."""
+
+    def __init__(self, attempts = 3, backoff = 0.1, max_backoff = 2.0, hedge_percentile = None,
+                 hedge_min_samples = 20, budget_ratio = 0.1, budget_max = 10.0, breaker = None,
+                 retry_on = (ConnectionError, GatewayConnectionError, Timeout), max_workers = 8):
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.budget_ratio = budget_ratio
+        self.budget_max = budget_max
+        self.breaker = breaker
+        self.retry_on = retry_on
+
+        self._tokens = budget_max
+        self._latencies = deque(maxlen=1000)
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers) if hedge_percentile else None
+
+    def is_idempotent(self, url):
+        """Return True if the request to url may safely be sent more than once."""
+
+        return IDEMPOTENT.search(url) is not None
+
+    def _spend(self):
+        """Take a token from the retry budget. Return False if there are none."""
+
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def _hedge_delay(self):
+        """Return how long to wait before hedging a read, or None."""
+
+        if not self.hedge_percentile:
+            return None
+        with self._lock:
+            if len(self._latencies) < self.hedge_min_samples:
+                return None
+            latencies = sorted(self._latencies)
+        return latencies[int(self.hedge_percentile / 100.0 * (len(latencies) - 1))]
+
+    def _attempt(self, send, timeout, read = False):
+        """Send once through the circuit breaker. If read is True, the
+        latency of a successful request is recorded for hedging."""
+
+        breaker = self.breaker
+        trial = breaker is not None and breaker.allow()
+
+        started = time.monotonic()
+        try:
+            response = send(timeout)
+        except self.retry_on:
+            if breaker is not None:
+                breaker.failure(trial)
+            raise
+        except MouseTrap:
+            # any other error response means CheddarGetter is reachable
+            if breaker is not None:
+                breaker.success()
+            raise
+        except BaseException:
+            # never leave a trial request outstanding; requests that were
+            # already in flight when the circuit opened don't own it
+            if trial:
+                breaker.release()
+            raise
+
+        if breaker is not None:
+            breaker.success()
+        if read:
+            with self._lock:
+                self._latencies.append(time.monotonic() - started)
+        return response
+
+    def _hedged(self, send, timeout_for, delay):
+        """Send a read, and a hedged copy if the first is slower than delay.
+        Return the first response to arrive."""
+
+        pending = set([self._pool.submit(self._attempt, send, timeout_for(), True)])
+        done, pending = wait(pending, timeout=delay)
+        if not done and self._spend():
+            pending.add(self._pool.submit(self._attempt, send, timeout_for(), True))
+
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+        raise error
+
+    def call(self, url, send, timeout_for, stream = False):
+        """Send a request through this policy.
+
+        send is called with a timeout to send the request once; timeout_for
+        returns the timeout to give the next attempt (raising Timeout if the
+        deadline has passed)."""
+
+        if not self.is_idempotent(url):
+            return self._attempt(send, timeout_for())
+
+        with self._lock:
+            self._tokens = min(self.budget_max, self._tokens + self.budget_ratio)
+
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                delay = None if stream else self._hedge_delay()
+                if delay is not None:
+                    return self._hedged(send, timeout_for, delay)
+                # a streamed response's latency only covers the headers
+                return self._attempt(send, timeout_for(), read=not stream)
+
+            except CircuitOpen:
+                raise
+
+            except self.retry_on:
+                if attempt >= self.attempts or not self._spend():
+                    raise
+
+                # back off, but never past the deadline
+                pause = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+                left = deadline.remaining()
+                if left is not None and left <= pause:
+                    raise
+                time.sleep(pause)
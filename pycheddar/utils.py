@@ -1,28 +1,90 @@
 # vim: set fileencoding=utf-8 :
 
-import re
+import functools
+
+# every conversion is looked up in these tables first; they are preloaded
+# with the CheddarGetter vocabulary (see preload_keys), so the common keys
+# never have to be converted at all
+_underscored = {}
+_camel_cased = {}
+
+# keys outside of the preloaded vocabulary are remembered in a bounded
+# cache, so arbitrary input can't grow memory use without limit
+UNKNOWN_KEY_CACHE_SIZE = 4096
+
+# XML tags and request arguments that are not fields of any object
+VOCABULARY = (
+    'customers', 'customer', 'subscriptions', 'subscription', 'plans', 'plan',
+    'items', 'item', 'invoices', 'invoice', 'transactions', 'transaction',
+    'charges', 'charge', 'promotions', 'promotion', 'incentives', 'incentive',
+    'coupons', 'coupon', 'meta_data', 'meta_datum', 'gateway_account', 'error',
+    'id', 'code', 'plan_code', 'item_code', 'charge_code', 'coupon_code',
+    'quantity', 'each_amount', 'remaining_balance', 'cc_number', 'cc_expiration',
+    'cc_card_code', 'subscription_status', 'created_after_date',
+    'created_before_date', 'canceled_after_date', 'canceled_before_date',
+    'transacted_after_date', 'transacted_before_date', 'order_by', 'order_by_direction',
+    'search', 'method', 'return_url', 'cancel_url', 'initial_bill_date',
+)
+
+
+def _convert_to_underscores(key):
+    """Convert camel case to underscores in a single pass."""
+
+    return ''.join(['_' + char.lower() if 'A' <= char <= 'Z' else char for char in key])
+
+
+def _convert_to_camel_case(key):
+    """Convert underscores to camel case in a single pass. Each run of
+    underscores is dropped, and the character after it capitalized."""
+
+    chars = []
+    capitalize = False
+    for char in key:
+        if char == '_':
+            capitalize = True
+        elif capitalize:
+            chars.append(char.upper())
+            capitalize = False
+        else:
+            chars.append(char)
+
+    return ''.join(chars)
+
+
+_unknown_to_underscores = functools.lru_cache(maxsize=UNKNOWN_KEY_CACHE_SIZE)(_convert_to_underscores)
+_unknown_to_camel_case = functools.lru_cache(maxsize=UNKNOWN_KEY_CACHE_SIZE)(_convert_to_camel_case)
 
 
 def to_underscores(key):
     """Utility method to convert a camel-cased key (like what is generally used in CheddarGetter)
     to an underscored key (like what is generally used in Python)."""
 
-    match = re.search(r'([A-Z])', key)
-    while match:
-        char = match.groups()[0]
-        key = key.replace(char, '_' + char.lower())
-        match = re.search(r'([A-Z])', key)
-
-    return key
+    try:
+        return _underscored[key]
+    except KeyError:
+        return _unknown_to_underscores(key)
 
 
 def to_camel_case(key):
     """Convert an underscored key (like what is generally used in Python code)
     to a camel-cased key (like what is generally used in CheddarGetter)."""
 
-    while '_' in key:
-        ix = key.index('_')
-        next = key[ix + 1].upper()
-        key = key[0:ix] + next + key[ix + 2:]
+    try:
+        return _camel_cased[key]
+    except KeyError:
+        return _unknown_to_camel_case(key)
+
+
+def preload_keys(keys):
+    """Add underscored keys, and their camel-cased forms, to the
+    conversion tables."""
+
+    for key in keys:
+        camel = _convert_to_camel_case(key)
+        _camel_cased[key] = camel
+        _camel_cased[camel] = _convert_to_camel_case(camel)
+        _underscored[camel] = _convert_to_underscores(camel)
+        _underscored[key] = _convert_to_underscores(key)
+
 
-    return key
+preload_keys(VOCABULARY)
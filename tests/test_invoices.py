@@ -0,0 +1,80 @@
+# vim: set fileencoding=utf-8 :
+
+import unittest
+from xml.etree.ElementTree import fromstring
+from pycheddar import Customer, FieldNotLoaded
+
+CHARGE = '<charge id="c{0}"><eachAmount>{1}</eachAmount><quantity>{2}</quantity></charge>'
+TRANSACTION = ('<transaction id="t{0}"><amount>{1}</amount><response>{2}</response>'
+               '<isRefund>{3}</isRefund></transaction>')
+
+
+def invoice(id, billed, charges = (), transactions = ()):
+    xml = '<invoice id="{0}"><billingDatetime>{1}</billingDatetime>'.format(id, billed)
+    if charges:
+        xml += '<charges>{0}</charges>'.format(''.join(CHARGE.format(id, *charge) for charge in charges))
+    if transactions:
+        xml += '<transactions>{0}</transactions>'.format(
+            ''.join(TRANSACTION.format('{0}_{1}'.format(id, number), *transaction)
+                    for number, transaction in enumerate(transactions)))
+    return xml + '</invoice>'
+
+
+def customer(invoices, **kwargs):
+    return Customer.from_xml(fromstring(
+        '<customer id="1" code="C"><email>c@example.com</email><subscriptions>'
+        '<subscription id="s"><plans><plan id="p" code="PRO"/></plans>'
+        '<invoices>{0}</invoices></subscription></subscriptions></customer>'.format(''.join(invoices))), **kwargs)
+
+
+class InvoicePageTest(unittest.TestCase):
+
+    def page(self, *invoices):
+        return next(customer(invoices).invoice_history())
+
+    def test_charge_with_zero_quantity_counts_nothing(self):
+        page = self.page(invoice('i', '2012-01-01', charges=[('10.00', '1'), ('5.00', '0')]))
+        self.assertEqual(page.charged, 10.0)
+
+    def test_charge_without_quantity_counts_once(self):
+        page = self.page(invoice('i', '2012-01-01', charges=[('10.00', '')]))
+        self.assertEqual(page.charged, 10.0)
+
+    def test_declined_transactions_are_not_paid(self):
+        page = self.page(invoice('i', '2012-01-01', transactions=[('10.00', 'declined', '0'),
+                                                                  ('10.00', 'error', '0')]))
+        self.assertEqual(page.paid, 0.0)
+
+    def test_every_transaction_is_counted(self):
+        page = self.page(invoice('i', '2012-01-01', transactions=[('10.00', 'declined', '0'),
+                                                                  ('10.00', 'approved', '0'),
+                                                                  ('4.00', 'approved', '1')]))
+        self.assertEqual(page.paid, 6.0)
+
+    def test_running_totals_run_newest_first(self):
+        pages = list(customer([invoice(str(i), '2012-01-{0:02d}'.format(i + 1), charges=[('1.00', '1')],
+                                       transactions=[('1.00', 'approved', '0')]) for i in range(5)])
+                     .invoice_history(page_size=2))
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertEqual([invoice.id for invoice in pages[0]], ['4', '3'])
+        self.assertEqual([page.running_charged for page in pages], [2.0, 4.0, 5.0])
+        self.assertEqual([page.running_paid for page in pages], [2.0, 4.0, 5.0])
+
+
+class LazyInvoicesTest(unittest.TestCase):
+
+    def test_older_invoices_are_kept_compact(self):
+        loaded = customer([invoice(str(i), '2012-01-01T00:00:{0:02d}'.format(i)) for i in range(25)])
+        raws = loaded.subscription._raw_children['invoices'][1]
+
+        self.assertEqual(sum(isinstance(raw, bytes) for billed, raw in raws), 15)
+        self.assertEqual([invoice.id for invoice in loaded.subscription.invoices], [str(i) for i in range(25)])
+
+    def test_unprojected_invoices_raise(self):
+        loaded = customer([invoice('i', '2012-01-01')], only=['email', 'subscription.plans'])
+        with self.assertRaises(FieldNotLoaded):
+            next(loaded.invoice_history())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+# vim: set fileencoding=utf-8 :
+
+import threading
+import unittest
+from pycheddar import ConnectionError, NotFound
+from pycheddar.exceptions import CircuitOpen
+from pycheddar.retry import CircuitBreaker, RetryPolicy
+
+READ_URL = 'https://cheddargetter.com/xml/customers/get/code/A/productCode/P/'
+WRITE_URL = 'https://cheddargetter.com/xml/customers/edit/code/A/productCode/P/'
+
+
+def raising(exception):
+    def send(timeout):
+        raise exception
+    return send
+
+
+def timeout_for():
+    return 1.0
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def test_error_response_during_trial_closes_circuit(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        policy = RetryPolicy(attempts=1, breaker=breaker)
+
+        with self.assertRaises(ConnectionError):
+            policy.call(READ_URL, raising(ConnectionError()), timeout_for)
+
+        # the trial gets an answer from CheddarGetter, if not a happy one
+        with self.assertRaises(NotFound):
+            policy.call(READ_URL, raising(NotFound()), timeout_for)
+
+        self.assertFalse(breaker._trial)
+        self.assertEqual(policy.call(READ_URL, lambda timeout: 'ok', timeout_for), 'ok')
+
+    def test_unexpected_error_during_trial_releases_it(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        policy = RetryPolicy(attempts=1, breaker=breaker)
+
+        with self.assertRaises(ConnectionError):
+            policy.call(READ_URL, raising(ConnectionError()), timeout_for)
+        with self.assertRaises(KeyError):
+            policy.call(READ_URL, raising(KeyError()), timeout_for)
+
+        self.assertFalse(breaker._trial)
+        self.assertEqual(policy.call(READ_URL, lambda timeout: 'ok', timeout_for), 'ok')
+
+    def test_request_in_flight_does_not_end_the_trial(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        policy = RetryPolicy(attempts=1, breaker=breaker)
+        sent, finish = threading.Event(), threading.Event()
+
+        def slow(timeout):
+            sent.set()
+            finish.wait()
+            raise KeyError()
+
+        def in_flight():
+            with self.assertRaises(KeyError):
+                policy.call(READ_URL, slow, timeout_for)
+
+        # a request goes out while the circuit is still closed
+        thread = threading.Thread(target=in_flight)
+        thread.start()
+        sent.wait()
+
+        with self.assertRaises(ConnectionError):
+            policy.call(READ_URL, raising(ConnectionError()), timeout_for)
+
+        def trial(timeout):
+            # the old request ends while the trial is out
+            finish.set()
+            thread.join()
+            self.assertTrue(breaker._trial)
+            with self.assertRaises(CircuitOpen):
+                breaker.allow()
+            return 'ok'
+
+        self.assertEqual(policy.call(READ_URL, trial, timeout_for), 'ok')
+        self.assertFalse(breaker._trial)
+
+    def test_open_circuit_fails_fast(self):
+        policy = RetryPolicy(attempts=1, breaker=CircuitBreaker(failure_threshold=1, reset_timeout=60))
+
+        with self.assertRaises(ConnectionError):
+            policy.call(READ_URL, raising(ConnectionError()), timeout_for)
+        with self.assertRaises(CircuitOpen):
+            policy.call(READ_URL, lambda timeout: 'ok', timeout_for)
+
+
+class RetryPolicyTest(unittest.TestCase):
+
+    def test_only_reads_are_retried(self):
+        calls = []
+
+        def send(timeout):
+            calls.append(timeout)
+            raise ConnectionError()
+
+        policy = RetryPolicy(attempts=3, backoff=0)
+        with self.assertRaises(ConnectionError):
+            policy.call(WRITE_URL, send, timeout_for)
+        self.assertEqual(len(calls), 1)
+
+        with self.assertRaises(ConnectionError):
+            policy.call(READ_URL, send, timeout_for)
+        self.assertEqual(len(calls), 4)
+
+    def test_only_read_latencies_are_recorded(self):
+        policy = RetryPolicy()
+
+        policy.call(WRITE_URL, lambda timeout: 'ok', timeout_for)
+        self.assertEqual(len(policy._latencies), 0)
+
+        policy.call(READ_URL, lambda timeout: 'ok', timeout_for)
+        self.assertEqual(len(policy._latencies), 1)
+
+    def test_streamed_read_latencies_are_not_recorded(self):
+        policy = RetryPolicy()
+
+        policy.call(READ_URL, lambda timeout: 'ok', timeout_for, stream=True)
+        self.assertEqual(len(policy._latencies), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()